@@ -0,0 +1,179 @@
+"""
+Аутентификация по токену без запроса к базе на каждый вызов API.
+
+Пара токен -> пользователь хранится в памяти процесса: не дольше
+AUTH_CACHE_SECONDS и не больше AUTH_CACHE_SIZE записей, вытесняются
+давно не использованные. Выход и удаление токена, смена пароля,
+блокировка и удаление пользователя сбрасывают записи в этом процессе
+после фиксации транзакции, а в остальных - через версию в общем кэше,
+которая проверяется не реже раза в CHECK_INTERVAL секунд. Прочие
+изменения пользователя сбрасывают только его записи в этом процессе,
+в остальных они живут до истечения AUTH_CACHE_SECONDS.
+"""
+import copy
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.authentication import (BasicAuthentication,
+                                           TokenAuthentication)
+
+from api.versions import CHECK_INTERVAL, bump_version, get_version
+
+AUTH_VERSION = 'auth'
+
+
+class CredentialsCache:
+    """ LRU-кэш пар (пользователь, auth) с ограниченным временем жизни. """
+
+    def __init__(self, size, timeout, check_interval=CHECK_INTERVAL):
+        self.size = size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._user_keys = defaultdict(set)
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _check_version(self, now):
+        if now - self._checked_at < self.check_interval:
+            return
+        version = get_version(AUTH_VERSION)
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+            self._checked_at = now
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[1][0].pk
+        keys = self._user_keys[user_id]
+        keys.discard(key)
+        if not keys:
+            del self._user_keys[user_id]
+
+    def _clear(self):
+        self._entries.clear()
+        self._user_keys.clear()
+
+    def get(self, key):
+        now = time.monotonic()
+        self._check_version(now)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        if not self.size:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._user_keys[value[0].pk].add(key)
+            while len(self._entries) > self.size:
+                self._pop(next(iter(self._entries)))
+
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def discard_user(self, user_id):
+        """ Убирает все токены и Basic-записи пользователя. """
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+
+credentials_cache = CredentialsCache(settings.AUTH_CACHE_SIZE,
+                                     settings.AUTH_CACHE_SECONDS)
+
+
+def cached_credentials(key):
+    """ Пара (пользователь, auth) из кэша или None. """
+    cached = credentials_cache.get(key)
+    if cached is None:
+        return None
+    # Каждый запрос получает свою копию пользователя: представления
+    # вправе менять request.user, а кэш разделяют потоки процесса.
+    user, auth = cached
+    return copy.copy(user), auth
+
+
+def invalidate(token_key=None):
+    """
+    Сбрасывает кэш здесь и, через версию, во всех процессах после
+    фиксации транзакции, чтобы его не заполнили старые строки.
+    """
+    def run():
+        if token_key is None:
+            credentials_cache.clear()
+        else:
+            credentials_cache.discard(token_key)
+        bump_version(AUTH_VERSION)
+
+    transaction.on_commit(run)
+
+
+def invalidate_user(user_id, everywhere=False):
+    """
+    Сбрасывает записи одного пользователя в этом процессе после фиксации
+    транзакции. Смена пароля, блокировка и удаление (everywhere)
+    сбрасывают кэш и в остальных.
+    """
+    def run():
+        credentials_cache.discard_user(user_id)
+        if everywhere:
+            bump_version(AUTH_VERSION)
+
+    transaction.on_commit(run)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = cached_credentials(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        credentials_cache.set(key, (user, token))
+        return user, token
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic-аутентификация, проверяющая пароль раз в AUTH_CACHE_SECONDS.
+
+    Хэш пароля (PBKDF2) считается только при промахе кэша; ключом служит
+    HMAC пары логин-пароль, сами учётные данные в памяти не хранятся.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        key = 'basic:' + hmac.new(
+            settings.SECRET_KEY.encode(),
+            f'{userid}\0{password}'.encode(),
+            hashlib.sha256,
+        ).hexdigest()
+        cached = cached_credentials(key)
+        if cached is not None:
+            return cached
+        user, auth = super().authenticate_credentials(userid, password,
+                                                      request)
+        credentials_cache.set(key, (user, auth))
+        return user, auth
@@ -0,0 +1,35 @@
+"""
+Кэш справочника тегов в памяти процесса.
+
+Теги меняются несколько раз в год, поэтому список и каждый тег хранятся
+уже сериализованными в JSON, а фильтр рецептов проверяет slug по словарю
+без запроса к базе. Версия справочника лежит в общем кэше и меняется
+сигналами модели Tag, так что все воркеры видят изменения.
+"""
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import TagSerializer
+from api.versions import VersionedSnapshot
+from foodgram.replica import PRIMARY
+from recipes.models import Tag
+
+TAGS_VERSION = 'tags'
+
+
+class TagCatalog:
+    def __init__(self, tags):
+        renderer = JSONRenderer()
+        self.content = renderer.render(tags)
+        self.items = {tag['id']: renderer.render(tag) for tag in tags}
+        self.slug_ids = {tag['slug']: tag['id'] for tag in tags}
+
+
+def build_tag_catalog():
+    # С основной базы: отстающая реплика сохранила бы под новой версией
+    # старый справочник до следующей правки.
+    return TagCatalog(
+        TagSerializer(Tag.objects.using(PRIMARY), many=True).data
+    )
+
+
+tag_catalog = VersionedSnapshot(TAGS_VERSION, build_tag_catalog)
@@ -1,34 +1,42 @@
-from django.db.models import BooleanField, ExpressionWrapper, Q
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.exceptions import ValidationError
+
+from api.catalogs import tag_catalog
+from api.serializers import RecipeIdsSerializer
+from recipes.models import Favorite, ListCart, Recipe
+from recipes.search import search_recipes
 
 User = get_user_model()
 
+# Сортировки рецептов; id в конце делает порядок однозначным
+# для постраничной и keyset-пагинации.
+ORDERINGS = {
+    'newest': ('-pub_date', '-id'),
+    'fastest': ('cooking_time', 'id'),
+    'popular': ('-favorites_count', '-id'),
+}
 
-class IngredientFilter(FilterSet):
-    name = filters.CharFilter(method='filter_name')
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
 
-    def filter_name(self, queryset, name, value):
-        return queryset.filter(
-            Q(name__istartswith=value) | Q(name__icontains=value)
-        ).annotate(
-            startswith=ExpressionWrapper(
-                Q(name__istartswith=value),
-                output_field=BooleanField()
-            )
-        ).order_by('-startswith')
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_catalog.get().slug_ids]
 
 
 class RecipesFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug',
+    """
+    Фильтры рецептов. Теги, избранное и корзина проверяются
+    подзапросами EXISTS, поэтому рецепт не повторяется в выдаче
+    и DISTINCT не нужен. search сортирует по релевантности,
+    если не передан ordering.
+    """
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='filter_tags',
     )
     author = filters.ModelChoiceFilter(
         queryset=User.objects.all(),
@@ -39,20 +47,76 @@ class RecipesFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart',
     )
+    search = filters.CharFilter(
+        method='filter_search',
+    )
+    cooking_time_min = filters.NumberFilter(
+        field_name='cooking_time',
+        lookup_expr='gte',
+    )
+    cooking_time_max = filters.NumberFilter(
+        field_name='cooking_time',
+        lookup_expr='lte',
+    )
+    ids = NumberInFilter(
+        method='filter_ids',
+    )
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in ORDERINGS],
+        method='order_by',
+    )
 
     class Meta:
         model = Recipe
-        fields = ['is_favorited', 'author', 'tags', 'is_in_shopping_cart']
+        fields = ['is_favorited', 'author', 'tags', 'is_in_shopping_cart',
+                  'search', 'cooking_time_min', 'cooking_time_max',
+                  'ids', 'ordering']
+
+    def filter_tags(self, queryset, name, value):
+        slug_ids = tag_catalog.get().slug_ids
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'),
+            tag_id__in=[slug_ids[slug] for slug in value]
+        )))
 
     def get_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(favorites__user=user)
+            return queryset.filter(Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )))
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(recipe_shopping_cart__user=user)
+            return queryset.filter(Exists(ListCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )))
         return queryset
 
+    def filter_queryset(self, queryset):
+        # Пустой ?ids= фильтр пропустил бы, и ответ без страниц вернул бы
+        # все рецепты.
+        if 'ids' in self.data and not self.form.cleaned_data.get('ids'):
+            self.invalid_ids()
+        return super().filter_queryset(queryset)
+
+    def invalid_ids(self):
+        raise ValidationError({'ids': (
+            f'Укажите от 1 до {RecipeIdsSerializer.MAX_IDS} id через запятую'
+        )})
+
+    def filter_ids(self, queryset, name, value):
+        ids = [pk for pk in value if pk is not None]
+        if not ids or len(ids) > RecipeIdsSerializer.MAX_IDS:
+            self.invalid_ids()
+        # По нему представление отдаёт этот набор целиком, без страниц.
+        self.request.recipe_ids = ids
+        return queryset.filter(pk__in=ids)
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def order_by(self, queryset, name, value):
+        return queryset.order_by(*ORDERINGS[value])
@@ -0,0 +1,140 @@
+"""
+Поиск ингредиентов для автодополнения без обращения к базе.
+
+Каталог загружается один раз на процесс: отсортированный массив
+нормализованных названий для поиска по префиксу и индекс триграмм
+для поиска по подстроке. Номера строк хранятся в array, а не в списках
+объектов, чтобы каждый воркер держал компактную структуру.
+"""
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from functools import cached_property
+
+from rest_framework.renderers import JSONRenderer
+
+from api.versions import VersionedSnapshot
+from foodgram.replica import PRIMARY
+from recipes.models import Ingredient
+
+NGRAM = 3
+VERSION_NAME = 'ingredients'
+
+
+def normalize(value):
+    """ Приводит строку к виду для сравнения: регистр, ё -> е. """
+    return value.casefold().replace('ё', 'е').strip()
+
+
+def ngrams(value):
+    return {value[i:i + NGRAM] for i in range(len(value) - NGRAM + 1)}
+
+
+class IngredientIndex:
+    """ Неизменяемый индекс каталога ингредиентов. """
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: (normalize(row[1]), row[0]))
+        self.ids = array('q', (row[0] for row in rows))
+        self.positions = {
+            ingredient_id: position
+            for position, ingredient_id in enumerate(self.ids)
+        }
+        self.names = [row[1] for row in rows]
+        self.units = [row[2] for row in rows]
+        self.keys = [normalize(name) for name in self.names]
+        postings = defaultdict(lambda: array('I'))
+        for position, key in enumerate(self.keys):
+            for gram in ngrams(key):
+                postings[gram].append(position)
+        self.postings = dict(postings)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def item(self, position):
+        return {
+            'id': self.ids[position],
+            'name': self.names[position],
+            'measurement_unit': self.units[position],
+        }
+
+    def all(self):
+        return [self.item(position) for position in range(len(self))]
+
+    def get(self, ingredient_id):
+        position = self.positions.get(ingredient_id)
+        return None if position is None else self.item(position)
+
+    @cached_property
+    def content(self):
+        """ Весь каталог, уже сериализованный в JSON. """
+        return JSONRenderer().render(self.all())
+
+    def prefix_positions(self, query):
+        start = bisect_left(self.keys, query)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(query):
+            end += 1
+        return range(start, end)
+
+    def substring_positions(self, query):
+        if len(query) < NGRAM:
+            return (position for position, key in enumerate(self.keys)
+                    if query in key)
+        grams = sorted(ngrams(query),
+                       key=lambda gram: len(self.postings.get(gram, ())))
+        candidates = self.postings.get(grams[0])
+        if candidates is None:
+            return ()
+        for gram in grams[1:]:
+            other = set(self.postings.get(gram, ()))
+            candidates = [position for position in candidates
+                          if position in other]
+        return (position for position in candidates
+                if query in self.keys[position])
+
+    def search(self, query, limit=None):
+        """ Сначала совпадения по префиксу, затем по подстроке. """
+        query = normalize(query)
+        if not query:
+            return self.all()[:limit]
+        found = []
+        prefix = self.prefix_positions(query)
+        for position in prefix:
+            if limit is not None and len(found) >= limit:
+                return found
+            found.append(self.item(position))
+        for position in self.substring_positions(query):
+            if limit is not None and len(found) >= limit:
+                break
+            if position not in prefix:
+                found.append(self.item(position))
+        return found
+
+
+def build_index():
+    # Индекс собирается по новой версии, поэтому читает основную базу,
+    # а не реплику, которая может ещё не видеть изменений.
+    return IngredientIndex(
+        Ingredient.objects.using(PRIMARY).values_list(
+            'id', 'name', 'measurement_unit'
+        ).order_by().iterator()
+    )
+
+
+_snapshot = VersionedSnapshot(VERSION_NAME, build_index)
+
+
+def get_index():
+    """ Индекс текущего процесса, пересобирается при смене версии. """
+    return _snapshot.get()
+
+
+def invalidate():
+    """ Сбрасывает индекс во всех процессах через версию в кэше. """
+    _snapshot.invalidate()
+
+
+def search(query, limit=None):
+    return get_index().search(query, limit)
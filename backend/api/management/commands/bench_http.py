@@ -0,0 +1,99 @@
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('measure throughput and latency of a running server under '
+            'concurrency, e.g. to compare WSGI and ASGI workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+',
+                            help='http://host:port/path, requested in turn')
+        parser.add_argument('-c', '--concurrency', default=32, type=int)
+        parser.add_argument('-n', '--requests', default=2000, type=int)
+        parser.add_argument('-H', '--header', action='append', default=[],
+                            help='extra header, "Name: value"')
+
+    def handle(self, *args, **options):
+        targets = [urlsplit(url) for url in options['urls']]
+        if any(target.scheme != 'http' for target in targets):
+            raise CommandError('Поддерживаются только http:// адреса')
+        headers = {}
+        for header in options['header']:
+            name, _, value = header.partition(':')
+            headers[name.strip()] = value.strip()
+        total = options['requests']
+        counter = iter(range(total))
+        lock = threading.Lock()
+        latencies = []
+        errors = []
+
+        def worker():
+            connections = {}
+            while True:
+                with lock:
+                    number = next(counter, None)
+                if number is None:
+                    break
+                target = targets[number % len(targets)]
+                path = target.path or '/'
+                if target.query:
+                    path += '?' + target.query
+                started = time.perf_counter()
+                try:
+                    connection = connections.get(target.netloc)
+                    if connection is None:
+                        connection = http.client.HTTPConnection(
+                            target.netloc, timeout=30
+                        )
+                        connections[target.netloc] = connection
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        errors.append(response.status)
+                except (OSError, http.client.HTTPException) as error:
+                    connections.pop(target.netloc, None)
+                    errors.append(type(error).__name__)
+                    continue
+                latencies.append(time.perf_counter() - started)
+            for connection in connections.values():
+                connection.close()
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        self.stdout.write(
+            f'{total} запросов, параллельно {options["concurrency"]}, '
+            f'{elapsed:.2f} с, {len(latencies) / elapsed:.1f} запросов/с'
+        )
+        if latencies:
+            self.stdout.write(
+                'задержка, мс: '
+                f'среднее {statistics.fmean(latencies) * 1000:.1f}, '
+                f'p50 {percentile(latencies, 0.50) * 1000:.1f}, '
+                f'p95 {percentile(latencies, 0.95) * 1000:.1f}, '
+                f'p99 {percentile(latencies, 0.99) * 1000:.1f}'
+            )
+        if errors:
+            self.stdout.write(self.style.WARNING(
+                f'ошибок: {len(errors)} ({", ".join(map(str, errors[:5]))})'
+            ))
@@ -0,0 +1,56 @@
+import logging
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from api.management.commands.bench_http import percentile
+from foodgram.log import BackgroundHandler
+
+
+class Command(BaseCommand):
+    help = ('measure in-process request time with the current logging '
+            'settings, e.g. DEBUG=1 LOG_SQL_SAMPLE_RATE=1 against DEBUG=0')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='/api/recipes/',
+                            help='path requested through the test client')
+        parser.add_argument('-n', '--requests', default=300, type=int)
+        parser.add_argument('--warmup', default=20, type=int)
+
+    def handle(self, *args, **options):
+        client = Client(HTTP_HOST='localhost')
+        path = options['path']
+        for _ in range(options['warmup']):
+            client.get(path)
+        timings = []
+        for _ in range(options['requests']):
+            started = time.perf_counter()
+            response = client.get(path)
+            timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{path} ответил {response.status_code}'
+                )
+        timings.sort()
+        self.stdout.write(
+            f'DEBUG={int(settings.DEBUG)}, LOG_LEVEL={settings.LOG_LEVEL}, '
+            f'LOG_FORMAT={settings.LOG_FORMAT}, '
+            f'LOG_SQL_SAMPLE_RATE={settings.LOG_SQL_SAMPLE_RATE}'
+        )
+        self.stdout.write(
+            f'{len(timings)} запросов {path}, мс: '
+            f'среднее {statistics.fmean(timings) * 1000:.2f}, '
+            f'p50 {percentile(timings, 0.50) * 1000:.2f}, '
+            f'p95 {percentile(timings, 0.95) * 1000:.2f}'
+        )
+        dropped = sum(
+            handler.dropped for handler in logging.getLogger().handlers
+            if isinstance(handler, BackgroundHandler)
+        )
+        if dropped:
+            self.stdout.write(self.style.WARNING(
+                f'отброшено записей лога: {dropped}'
+            ))
@@ -0,0 +1,253 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.management.commands.load_ingredients import batches
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
+                            ListCart, Recipe, Tag)
+from recipes.services import reconcile_counters
+from users.models import Subscription, User
+
+DEFAULT_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F2C94C', 'dessert'),
+    ('Постное', '#2D9CDB', 'lenten'),
+)
+DISHES = ('Суп', 'Салат', 'Запеканка', 'Рагу', 'Пирог', 'Паста', 'Каша',
+          'Омлет', 'Котлеты', 'Плов', 'Смузи', 'Блины', 'Тушёные овощи')
+STEPS = ('Нарежьте', 'Обжарьте', 'Смешайте', 'Отварите', 'Запеките',
+         'Взбейте', 'Добавьте', 'Потушите', 'Посолите', 'Остудите')
+DAYS = 3 * 365
+
+
+def zipf_weights(size, exponent):
+    """ Накопленные веса степенного закона для random.choices. """
+    return list(accumulate(1 / (rank ** exponent)
+                           for rank in range(1, size + 1)))
+
+
+def sample_unique(rng, population, cum_weights, count):
+    """ count разных элементов, чаще популярные. """
+    count = min(count, len(population))
+    if count * 2 > len(population):
+        return set(rng.sample(population, count))
+    chosen = set()
+    while len(chosen) < count:
+        chosen.update(rng.choices(population, cum_weights=cum_weights,
+                                  k=count - len(chosen)))
+    return chosen
+
+
+@contextmanager
+def explicit_dates(model, *names):
+    """ Даёт задать поля auto_now/auto_now_add вручную. """
+    fields = [model._meta.get_field(name) for name in names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('generate a reproducible synthetic dataset: users, recipes, '
+            'favorites, carts and subscriptions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', default=10_000, type=int)
+        parser.add_argument('--recipes', default=100_000, type=int)
+        parser.add_argument('--favorites', default=20, type=int,
+                            help='average favorites per user')
+        parser.add_argument('--carts', default=3, type=int,
+                            help='average recipes in a cart per user')
+        parser.add_argument('--subscriptions', default=10, type=int,
+                            help='average subscriptions per user')
+        parser.add_argument('--password', default='synthetic',
+                            help='password of every generated user')
+        parser.add_argument('--seed', default=1, type=int)
+        parser.add_argument('--batch-size', default=5000, type=int)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = f'synthetic{options["seed"]}_'
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f'Данные с seed={options["seed"]} уже созданы'
+            )
+        started = time.monotonic()
+        self.totals = {}
+        ingredient_ids = self.ingredient_ids()
+        tag_ids = self.tag_ids()
+        user_ids = self.create_users(options['users'],
+                                     options['password'])
+        recipe_ids = self.create_recipes(options['recipes'], user_ids,
+                                         ingredient_ids, tag_ids)
+        self.create_pairs(Favorite, user_ids, recipe_ids,
+                          options['favorites'])
+        self.create_pairs(ListCart, user_ids, recipe_ids, options['carts'])
+        self.create_subscriptions(user_ids, options['subscriptions'])
+        self.stdout.write('Пересчёт счётчиков и списков покупок...')
+        reconcile_counters(self.batch_size)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+
+        elapsed = time.monotonic() - started
+        rows = sum(self.totals.values())
+        for model, count in self.totals.items():
+            self.stdout.write(f'  {model}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано строк: {rows} за {elapsed:.1f} с '
+            f'({rows / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
+
+    def bulk_create(self, model, objects):
+        """ Пишет объекты пачками, возвращает их id. """
+        ids = []
+        for batch in batches(objects, self.batch_size):
+            with transaction.atomic():
+                created = model.objects.bulk_create(batch)
+            ids.extend(obj.pk for obj in created)
+            label = model._meta.label
+            self.totals[label] = self.totals.get(label, 0) + len(batch)
+        return ids
+
+    def ingredient_ids(self):
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        ids = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+        if not ids:
+            raise CommandError('Каталог ингредиентов пуст')
+        # Популярность ингредиентов не зависит от алфавита.
+        self.rng.shuffle(ids)
+        return ids
+
+    def tag_ids(self):
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=name, color=color, slug=slug)
+                for name, color, slug in DEFAULT_TAGS
+            )
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def create_users(self, count, password):
+        password = make_password(password)
+        return self.bulk_create(User, (
+            User(
+                username=f'{self.prefix}{number}',
+                email=f'{self.prefix}{number}@example.com',
+                first_name=f'Имя{number}',
+                last_name=f'Фамилия{number}',
+                password=password,
+            )
+            for number in range(count)
+        ))
+
+    def create_recipes(self, count, user_ids, ingredient_ids, tag_ids):
+        rng = self.rng
+        # Немногие авторы пишут большую часть рецептов.
+        authors = user_ids[:]
+        rng.shuffle(authors)
+        author_weights = zipf_weights(len(authors), 1.1)
+        ingredient_weights = zipf_weights(len(ingredient_ids), 0.8)
+        names = dict(Ingredient.objects.values_list('id', 'name'))
+        now = timezone.now()
+        # id растут вместе с датой публикации, как в живой базе.
+        dates = sorted(
+            now - timedelta(seconds=rng.randrange(DAYS * 24 * 3600))
+            for _ in range(count)
+        )
+
+        def recipes():
+            for pub_date in dates:
+                main = rng.choices(ingredient_ids,
+                                   cum_weights=ingredient_weights)[0]
+                yield Recipe(
+                    author_id=rng.choices(authors,
+                                          cum_weights=author_weights)[0],
+                    name=f'{rng.choice(DISHES)}: {names[main]}'[:200],
+                    text=' '.join(
+                        f'{rng.choice(STEPS)} {names[ingredient]}.'
+                        for ingredient in rng.sample(ingredient_ids, 4)
+                    ),
+                    cooking_time=max(1, int(rng.lognormvariate(3.4, 0.6))),
+                    pub_date=pub_date,
+                    updated_at=pub_date,
+                )
+
+        with explicit_dates(Recipe, 'pub_date', 'updated_at'):
+            recipe_ids = self.bulk_create(Recipe, recipes())
+
+        def ingredients():
+            for recipe_id in recipe_ids:
+                for ingredient_id in sample_unique(
+                    rng, ingredient_ids, ingredient_weights,
+                    rng.randint(3, 12)
+                ):
+                    yield IngredientInRecipe(
+                        recipe_id=recipe_id, ingredient_id=ingredient_id,
+                        amount=rng.choice((1, 2, 5, 10, 50, 100, 200, 500))
+                    )
+
+        def tags():
+            through = Recipe.tags.through
+            for recipe_id in recipe_ids:
+                for tag_id in rng.sample(tag_ids,
+                                         rng.randint(1, min(3, len(tag_ids)))):
+                    yield through(recipe_id=recipe_id, tag_id=tag_id)
+
+        self.bulk_create(IngredientInRecipe, ingredients())
+        self.bulk_create(Recipe.tags.through, tags())
+        return recipe_ids
+
+    def create_pairs(self, model, user_ids, recipe_ids, average):
+        """ Избранное или корзины: популярные рецепты встречаются чаще. """
+        if not average or not recipe_ids:
+            return
+        rng = self.rng
+        recipe_weights = zipf_weights(len(recipe_ids), 0.9)
+        # Свежие рецепты популярнее.
+        popular = sorted(recipe_ids, reverse=True)
+
+        def pairs():
+            for user_id in user_ids:
+                count = int(rng.expovariate(1 / average))
+                for recipe_id in sample_unique(rng, popular, recipe_weights,
+                                               count):
+                    yield model(user_id=user_id, recipe_id=recipe_id)
+
+        self.bulk_create(model, pairs())
+
+    def create_subscriptions(self, user_ids, average):
+        """ Граф подписок со степенным распределением подписчиков. """
+        if not average or len(user_ids) < 2:
+            return
+        rng = self.rng
+        authors = user_ids[:]
+        rng.shuffle(authors)
+        author_weights = zipf_weights(len(authors), 1.0)
+
+        def subscriptions():
+            for user_id in user_ids:
+                count = int(rng.expovariate(1 / average))
+                chosen = sample_unique(rng, authors, author_weights,
+                                       count + 1)
+                chosen.discard(user_id)
+                for author_id in list(chosen)[:count]:
+                    yield Subscription(user_id=user_id, author_id=author_id)
+
+        self.bulk_create(Subscription, subscriptions())
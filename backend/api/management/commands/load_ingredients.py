@@ -1,36 +1,147 @@
+import csv
+import io
 import json
 import os
+import time
+from itertools import islice
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db.utils import IntegrityError
+from django.db import connection, transaction
 
+from api import ingredient_search
 from recipes.models import Ingredient
 
 DATA_ROOT = os.path.join(settings.BASE_DIR, 'data')
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json(file):
+    """ Читает JSON-массив объектов по частям, не загружая файл целиком. """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise CommandError('Ожидается JSON-массив')
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer.startswith(','):
+                buffer = buffer[1:]
+                continue
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                break
+            yield item['name'], item['measurement_unit']
+            buffer = buffer[end:]
+        if not chunk:
+            raise CommandError('Файл JSON обрывается')
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+READERS = {
+    '.json': iter_json,
+    '.csv': iter_csv,
+}
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def load_bulk(rows, batch_size):
+    for batch in batches(rows, batch_size):
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in batch],
+            ignore_conflicts=True,
+        )
+
+
+def load_copy(rows, batch_size):
+    """ COPY во временную таблицу и один INSERT ... ON CONFLICT. """
+    table = connection.ops.quote_name(Ingredient._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE ingredients_load '
+            '(name varchar(200), measurement_unit varchar(100)) '
+            'ON COMMIT DROP'
+        )
+        for batch in batches(rows, batch_size):
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            buffer.seek(0)
+            cursor.copy_expert(
+                'COPY ingredients_load FROM STDIN WITH (FORMAT csv)', buffer
+            )
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            f'SELECT DISTINCT name, measurement_unit FROM ingredients_load '
+            f'ON CONFLICT (name, measurement_unit) DO NOTHING'
+        )
 
 
 class Command(BaseCommand):
-    help = 'loading ingredients from data in json'
+    help = 'loading ingredients from data in json or csv'
 
     def add_arguments(self, parser):
         parser.add_argument('filename', default='ingredients.json', nargs='?',
                             type=str)
+        parser.add_argument('--batch-size', default=5000, type=int)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='use bulk_create even on PostgreSQL')
 
     def handle(self, *args, **options):
-        try:
-            with open(os.path.join(DATA_ROOT, options['filename']), 'r',
-                      encoding='utf-8') as f:
-                data = json.load(f)
-                for ingredient in data:
-                    try:
-                        Ingredient.objects.create(name=ingredient["name"],
-                                                  measurement_unit=ingredient[
-                                                      "measurement_unit"])
-                    except IntegrityError:
-                        print(f'Ингридиет {ingredient["name"]} '
-                              f'{ingredient["measurement_unit"]} '
-                              f'уже есть в базе')
+        path = os.path.join(DATA_ROOT, options['filename'])
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .json и .csv')
+        use_copy = (connection.vendor == 'postgresql'
+                    and not options['no_copy'])
+        started = time.monotonic()
+        before = Ingredient.objects.count()
+        read = 0
+
+        def counted(rows):
+            nonlocal read
+            for row in rows:
+                read += 1
+                yield row
 
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                with transaction.atomic():
+                    rows = counted(reader(f))
+                    if use_copy:
+                        load_copy(rows, options['batch_size'])
+                    else:
+                        load_bulk(rows, options['batch_size'])
         except FileNotFoundError:
             raise CommandError('Файл отсутствует в директории data')
+        ingredient_search.invalidate()
+
+        elapsed = time.monotonic() - started
+        created = Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {read}, добавлено {created}, '
+            f'пропущено дубликатов {read - created}; '
+            f'{elapsed:.2f} с, {read / max(elapsed, 1e-6):.0f} строк/с'
+        ))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+from recipes.services import BATCH_SIZE, compute_shopping_lists
+
+
+class Command(BaseCommand):
+    help = 'rebuild or verify materialized shopping lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='only report drift, do not write')
+
+    def handle(self, *args, **options):
+        expected = compute_shopping_lists()
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in
+            ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator(chunk_size=BATCH_SIZE)
+        }
+        drift = {
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        }
+        self.stdout.write(f'Строк в списках покупок: {len(expected)}, '
+                          f'расхождений: {len(drift)}')
+        if options['verify']:
+            for user_id, ingredient_id in sorted(drift)[:20]:
+                self.stdout.write(
+                    f'  user={user_id} ingredient={ingredient_id}: '
+                    f'{stored.get((user_id, ingredient_id))} != '
+                    f'{expected.get((user_id, ingredient_id))}'
+                )
+            if drift:
+                raise CommandError('Списки покупок расходятся с корзинами')
+            return
+        if not drift:
+            return
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (
+                    ShoppingListItem(user_id=user_id,
+                                     ingredient_id=ingredient_id,
+                                     amount=amount)
+                    for (user_id, ingredient_id), amount in expected.items()
+                ),
+                batch_size=BATCH_SIZE,
+            )
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import BATCH_SIZE, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'recalculate denormalized recipe and user counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', default=BATCH_SIZE, type=int)
+
+    def handle(self, *args, **options):
+        fixed = reconcile_counters(options['batch_size'])
+        for (model, field), count in fixed.items():
+            self.stdout.write(f'{model}.{field}: исправлено {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего исправлено строк: {sum(fixed.values())}'
+        ))
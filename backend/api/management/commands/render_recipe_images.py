@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'render missing recipe image renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='re-render renditions of every recipe')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(renditions={})
+        done = failed = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            try:
+                build_renditions(recipe_id)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe_id}: {error}')
+            else:
+                done += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано {done}, с ошибками {failed}'
+        ))
@@ -0,0 +1,199 @@
+"""
+Метрики запросов: заголовок Server-Timing и /metrics для Prometheus.
+
+Для каждого запроса считаются общее время, число SQL-запросов и время
+в базе, время сериализации и рендера, размер ответа. Метки - view
+и действие (например, RecipeViewSet.list). Под gunicorn значения
+пишутся в файлы каталога PROMETHEUS_MULTIPROC_DIR и складываются
+по всем воркерам при чтении /metrics.
+"""
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from rest_framework import serializers
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REQUESTS = Counter(
+    'foodgram_requests', 'Запросы', ('view', 'method', 'status')
+)
+DURATION = Histogram(
+    'foodgram_request_duration_seconds', 'Время запроса', ('view',),
+    buckets=TIME_BUCKETS
+)
+DB_DURATION = Histogram(
+    'foodgram_db_duration_seconds', 'Время в базе за запрос', ('view',),
+    buckets=TIME_BUCKETS
+)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries', 'SQL-запросов за запрос', ('view',),
+    buckets=QUERY_BUCKETS
+)
+SERIALIZE_DURATION = Histogram(
+    'foodgram_serialize_duration_seconds', 'Время сериализации',
+    ('view',), buckets=TIME_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    'foodgram_response_size_bytes', 'Размер ответа', ('view',),
+    buckets=SIZE_BUCKETS
+)
+
+_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db', 'serialize', 'serializing', 'render')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+        self.render = 0.0
+
+
+def count_query(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db += time.perf_counter() - started
+
+
+def wrap_connection(connection, **kwargs):
+    connection.execute_wrappers.append(count_query)
+
+
+def timed_data(data):
+    """ Время верхнего вызова serializer.data, без вложенных. """
+    getter = data.fget
+
+    def wrapper(self):
+        stats = _stats.get()
+        if stats is None or stats.serializing:
+            return getter(self)
+        stats.serializing = True
+        started = time.perf_counter()
+        try:
+            return getter(self)
+        finally:
+            stats.serializing = False
+            stats.serialize += time.perf_counter() - started
+
+    return property(wrapper)
+
+
+def install():
+    """ Подключает счётчики к соединениям с базой и сериализаторам. """
+    connection_created.connect(wrap_connection,
+                               dispatch_uid='api.metrics.wrap_connection')
+    serializers.Serializer.data = timed_data(serializers.Serializer.data)
+    serializers.ListSerializer.data = timed_data(
+        serializers.ListSerializer.data
+    )
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    func = match.func
+    view_class = getattr(func, 'cls', None)
+    if view_class is None:
+        return match.view_name
+    action = (getattr(func, 'actions', None) or {}).get(
+        request.method.lower(), request.method.lower()
+    )
+    return f'{view_class.__name__}.{action}'
+
+
+def render_response(response):
+    """ Рендерит ответ DRF, учитывая время в метриках запроса. """
+    if not callable(getattr(response, 'render', None)):
+        return response
+    stats = _stats.get()
+    if response.is_rendered or stats is None:
+        response.render()
+        return response
+    started = time.perf_counter()
+    response.render()
+    stats.render += time.perf_counter() - started
+    return response
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _stats.reset(token)
+        return self.record(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _stats.reset(token)
+        return self.record(request, response, stats, started)
+
+    def record(self, request, response, stats, started):
+        total = time.perf_counter() - started
+        view = view_name(request)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={stats.db * 1000:.1f};desc="{stats.queries} queries"',
+            f'serialize;dur={stats.serialize * 1000:.1f}',
+            f'render;dur={stats.render * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        DURATION.labels(view).observe(total)
+        DB_DURATION.labels(view).observe(stats.db)
+        DB_QUERIES.labels(view).observe(stats.queries)
+        SERIALIZE_DURATION.labels(view).observe(stats.serialize)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(view).observe(len(response.content))
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF отдаёт ответ нерендеренным: рендер меряется отдельно.
+        return render_response(response)
+
+
+def metrics(request):
+    """ Метрики в текстовом формате Prometheus. """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
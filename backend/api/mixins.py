@@ -1,7 +1,119 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
 from rest_framework import mixins, viewsets
 
+from api.metrics import render_response
+
 
 class CreateDestroyViewSet(mixins.CreateModelMixin,
                            mixins.DestroyModelMixin,
                            viewsets.GenericViewSet):
     pass
+
+
+def make_etag(*parts):
+    return quote_etag(
+        hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    )
+
+
+class ConditionalGetMixin:
+    """
+    Отвечает 304 на повторные GET, если ETag / Last-Modified не изменились.
+
+    Валидаторы считаются по версиям данных до сериализации ответа.
+    Анонимные ответы можно кэшировать в nginx или CDN, ответы
+    пользователю - только в его браузере с обязательной проверкой.
+    """
+    public_max_age = 60
+
+    def conditional_response(self, request, validators, respond):
+        etag, last_modified = validators
+        response = None
+        if etag is not None or last_modified is not None:
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+        if response is None:
+            response = respond()
+            if response.status_code == 200:
+                if etag is not None:
+                    response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+        else:
+            if etag is not None:
+                response['ETag'] = etag
+        self.patch_cache_headers(request, response)
+        return response
+
+    def patch_cache_headers(self, request, response):
+        patch_vary_headers(response, ('Authorization',))
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True,
+                                max_age=self.public_max_age)
+
+
+_read_executor = None
+
+
+def get_read_executor():
+    global _read_executor
+    if _read_executor is None:
+        _read_executor = ThreadPoolExecutor(
+            max_workers=settings.ASGI_READ_THREADS,
+            thread_name_prefix='asgi-read',
+        )
+    return _read_executor
+
+
+def run_read_view(view, request, *args, **kwargs):
+    """ Выполняет view в потоке пула и закрывает его устаревшие соединения. """
+    close_old_connections()
+    try:
+        return render_response(view(request, *args, **kwargs))
+    finally:
+        close_old_connections()
+
+
+class AsyncReadMixin:
+    """
+    Под ASGI действия из async_actions выполняются в отдельном пуле
+    потоков, а не в единственном потоке, который Django отводит
+    синхронным view: медленный запрос не держит остальные. Запись идёт
+    обычным путём. Под WSGI view не меняется.
+    """
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        read_methods = {
+            method for method, action in (actions or {}).items()
+            if action in cls.async_actions
+        }
+        if settings.SERVER_INTERFACE != 'asgi' or not read_methods:
+            return view
+        if 'get' in read_methods:
+            read_methods.add('head')
+        read = sync_to_async(partial(run_read_view, view),
+                             thread_sensitive=False,
+                             executor=get_read_executor())
+        write = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            if request.method.lower() in read_methods:
+                return await read(request, *args, **kwargs)
+            return await write(request, *args, **kwargs)
+
+        return update_wrapper(async_view, view)
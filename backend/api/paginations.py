@@ -1,6 +1,161 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу сортировки (например, pub_date, id).
+
+    Вместо OFFSET и COUNT(*) следующая страница выбирается условием
+    «после последней записи», поэтому глубокие страницы стоят столько же,
+    сколько первая. Курсор непрозрачен для клиента.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 6
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return size if size > 0 else self.page_size
+
+    def get_ordering(self, queryset):
+        """ Сортировка запроса, дополненная id для однозначности. """
+        ordering = [
+            field[:-2] + 'id' if field.lstrip('-') == 'pk' else field
+            for field in (queryset.query.order_by
+                          or queryset.model._meta.ordering)
+        ]
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return ordering
+
+    def encode_cursor(self, values, reverse):
+        values = [
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in values
+        ]
+        data = json.dumps({'v': values, 'r': int(reverse)})
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def to_python(self, queryset, name, value):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Аннотация, например релевантность поиска: значение из JSON.
+            return value
+        return field.to_python(value)
+
+    def decode_cursor(self, queryset, ordering, cursor):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [
+                self.to_python(queryset, field.lstrip('-'), value)
+                for field, value in zip(ordering, data['v'], strict=True)
+            ]
+            return values, bool(data['r'])
+        except (TypeError, ValueError, KeyError, LookupError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_key(self, obj, ordering):
+        return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+    def after(self, ordering, values, reverse):
+        """ Условие «строго после ключа» в порядке сортировки. """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        ordering = self.get_ordering(queryset)
+        cursor = request.query_params.get(self.cursor_query_param)
+        reverse = False
+        if cursor:
+            values, reverse = self.decode_cursor(queryset, ordering, cursor)
+            queryset = queryset.filter(self.after(ordering, values, reverse))
+        if reverse:
+            queryset = queryset.order_by(*(
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ))
+        else:
+            queryset = queryset.order_by(*ordering)
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+        self.has_next = has_more if not reverse else True
+        self.has_previous = bool(cursor) and (has_more or not reverse)
+        self.first_key = self.last_key = None
+        if results:
+            self.first_key = self.get_key(results[0], ordering)
+            self.last_key = self.get_key(results[-1], ordering)
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or self.last_key is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(self.last_key, reverse=False)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.first_key is None:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(self.first_key, reverse=True)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    Постраничная пагинация page/limit; с параметром cursor
+    переключается на KeysetPagination.
+    """
     page_size_query_param = 'limit'
     page_size = 6
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
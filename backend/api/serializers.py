@@ -1,13 +1,17 @@
 import base64
 
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
 from djoser.serializers import UserSerializer
 
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
-                            ListCart, Recipe, Tag)
+                            ListCart, Recipe, ShoppingListItem, Tag)
+from recipes.images import check_dimensions, schedule_renditions
+from recipes.services import change_counter, update_shopping_lists
 from users.models import Subscription, User
 
 
@@ -18,10 +22,32 @@ class Base64ImageField(serializers.ImageField):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
             data = ContentFile(base64.b64decode(imgstr), name='photo.' + ext)
-
+        try:
+            check_dimensions(data)
+        except (OSError, ValueError, AttributeError):
+            self.fail('invalid_image')
         return super().to_internal_value(data)
 
 
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """ Ссылки на уменьшенные копии изображения рецепта. """
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'renditions'
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for name, paths in (value or {}).items():
+            urls[name] = {}
+            for extension, path in paths.items():
+                url = default_storage.url(path)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls[name][extension] = url
+        return urls
+
+
 class UsersSerializer(UserSerializer):
     """ Сериализатор модели пользователя. """
     is_subscribed = serializers.SerializerMethodField()
@@ -38,6 +64,8 @@ class UsersSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'subscribed'):
+            return obj.subscribed
         if (self.context.get('request')
            and not self.context['request'].user.is_anonymous):
             return Subscription.objects.filter(
@@ -99,11 +127,23 @@ class AddIngredientRecipeSerializer(serializers.ModelSerializer):
         ]
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """ Оставляет только поля из context['fields'], если он задан. """
+    def get_fields(self):
+        fields = super().get_fields()
+        wanted = self.context.get('fields')
+        if wanted is None:
+            return fields
+        return {name: field for name, field in fields.items()
+                if name in wanted}
+
+
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """ Сериализатор просмотра модели Recipe. """
     tags = TagSerializer(read_only=True, many=True)
     author = UsersSerializer(read_only=True)
     image = Base64ImageField()
+    images = ImageRenditionsField()
     ingredients = AddIngredientRecipeSerializer(
         source='ingredientinrecipe_set',
         many=True,
@@ -124,11 +164,14 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time'
         )
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return (
             self.context.get('request').user.is_authenticated
             and Favorite.objects.filter(user=self.context['request'].user,
@@ -136,6 +179,8 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return (
             self.context.get('request').user.is_authenticated
             and ListCart.objects.filter(
@@ -144,61 +189,135 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
 
     def validate(self, value):
-        ingredient_list = []
         ingredients = self.initial_data.get('ingredients')
         if not ingredients:
             raise serializers.ValidationError({
                 'ingredients': 'Количество должно быть равным или больше 1'})
-        for ingredient_item in ingredients:
-            id_to_check = ingredient_item['id']
-            ingredient_to_check = Ingredient.objects.filter(id=id_to_check)
-            if not ingredient_to_check.exists():
-                raise serializers.ValidationError(
-                    'Данного продукта нет в базе')
-            if ingredient_to_check in ingredient_list:
-                raise serializers.ValidationError(
-                    'Данные продукты повторяются в рецепте')
-            ingredient_list.append(ingredient_to_check)
+        try:
+            amounts = [(int(item['id']), int(item['amount']))
+                       for item in ingredients]
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError({
+                'ingredients': 'Укажите id и количество каждого продукта'})
+        ingredient_amounts = dict(amounts)
+        if len(ingredient_amounts) != len(amounts):
+            raise serializers.ValidationError(
+                'Данные продукты повторяются в рецепте')
+        if any(amount < 1 for amount in ingredient_amounts.values()):
+            raise serializers.ValidationError({
+                'ingredients': 'Количество должно быть равным или больше 1'})
+        if Ingredient.objects.filter(
+            id__in=ingredient_amounts
+        ).count() != len(ingredient_amounts):
+            raise serializers.ValidationError(
+                'Данного продукта нет в базе')
+
+        tags = self.initial_data.get('tags')
+        if not tags:
+            raise serializers.ValidationError({
+                'tags': 'Нужно выбрать хотя бы один тег'})
+        try:
+            tag_ids = {int(tag) for tag in tags}
+        except (TypeError, ValueError):
+            raise serializers.ValidationError({
+                'tags': 'Укажите id тегов'})
+        if Tag.objects.filter(id__in=tag_ids).count() != len(tag_ids):
+            raise serializers.ValidationError({
+                'tags': 'Данного тега нет в базе'})
+
+        value['ingredients'] = ingredient_amounts
+        value['tags'] = tag_ids
         return value
 
     def create_ingredients(self, ingredients, recipe):
-        for i in ingredients:
-            IngredientInRecipe.objects.create(
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
                 recipe=recipe,
-                ingredient_id=i.get('id'),
-                amount=i.get('amount'),
+                ingredient_id=ingredient_id,
+                amount=amount,
             )
+            for ingredient_id, amount in ingredients.items()
+        )
 
+    def update_ingredients(self, ingredients, recipe):
+        """ Пишет только изменившиеся строки; возвращает старые количества. """
+        current = {
+            row.ingredient_id: row
+            for row in IngredientInRecipe.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in current.items()
+        }
+        removed = current.keys() - ingredients.keys()
+        if removed:
+            IngredientInRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        self.create_ingredients(
+            {ingredient_id: amount
+             for ingredient_id, amount in ingredients.items()
+             if ingredient_id not in current},
+            recipe
+        )
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = ingredients.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        return old_amounts
+
+    @transaction.atomic
     def create(self, validated_data):
-        image = validated_data.pop('image')
-
+        ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(
-            image=image,
             **validated_data,
             author=self.context['request'].user
         )
-
-        tags = self.initial_data.get('tags')
         recipe.tags.set(tags)
-        self.create_ingredients(self.initial_data.get('ingredients'), recipe)
+        self.create_ingredients(ingredients, recipe)
+        change_counter(User, recipe.author_id, 'recipes_count', 1)
+        schedule_renditions(recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
         instance.image = validated_data.get('image', instance.image)
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time
         )
-        instance.tags.clear()
-        tags = self.initial_data.get('tags')
+        # Счётчики избранного и корзин меняются параллельно через F().
+        instance.save(update_fields=(
+            'image', 'name', 'text', 'cooking_time', 'updated_at'
+        ))
         instance.tags.set(tags)
-        IngredientInRecipe.objects.filter(recipe=instance).all().delete()
-        self.create_ingredients(self.initial_data.get('ingredients'), instance)
-        instance.save()
+        old_amounts = self.update_ingredients(ingredients, instance)
+        update_shopping_lists(instance, old_amounts, ingredients)
+        if 'image' in validated_data:
+            schedule_renditions(instance.id)
         return instance
 
 
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """ Сериализатор строки материализованного списка покупок. """
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
 class FavoriteSerializer(serializers.ModelSerializer):
     """ Сериализатор модели Favorite. """
     id = serializers.ReadOnlyField(
@@ -265,9 +384,11 @@ class ListCartSerializer(serializers.ModelSerializer):
 
 class SubscribeRecipeSerializer(serializers.ModelSerializer):
     """ Сериализатор подписок пользователя. """
+    images = ImageRenditionsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
 class SubscriptionsSerializer(serializers.ModelSerializer):
@@ -289,32 +410,46 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
         read_only=True)
     recipes = serializers.SerializerMethodField()
     is_subscribed = serializers.SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(
-        source='author.recipe.count')
+    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Subscription
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed', 'recipes', 'recipes_count',)
 
+    def get_author(self, obj):
+        return obj.author
+
     def get_recipes(self, obj):
-        recipes = obj.author.recipe.all()
+        author = self.get_author(obj)
+        if hasattr(author, 'latest_recipes'):
+            recipes = author.latest_recipes
+        else:
+            recipes = author.recipe.all()[:self.context.get('recipes_limit')]
         return SubscribeRecipeSerializer(
             recipes,
-            many=True).data
+            many=True,
+            context=self.context).data
+
+    def get_recipes_count(self, obj):
+        return self.get_author(obj).recipes_count
 
     def get_is_subscribed(self, obj):
-        subscribe = Subscription.objects.filter(
+        if obj.user_id == self.context.get('request').user.id:
+            return True
+        return Subscription.objects.filter(
             user=self.context.get('request').user,
             author=obj.author
-        )
-        if subscribe:
-            return True
-        return False
+        ).exists()
 
 
 class UserSubscriptionsSerializer(SubscriptionsSerializer):
     """ Сериализатор модели пользователя. """
+    email = serializers.EmailField(read_only=True)
+    id = serializers.IntegerField(read_only=True)
+    username = serializers.CharField(read_only=True)
+    first_name = serializers.CharField(read_only=True)
+    last_name = serializers.CharField(read_only=True)
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -325,20 +460,33 @@ class UserSubscriptionsSerializer(SubscriptionsSerializer):
             'username',
             'first_name',
             'last_name',
-            'is_subscribed'
+            'is_subscribed',
+            'recipes',
+            'recipes_count',
         )
 
-    def get_recipes(self, obj):
-        recipes = obj.recipe.all()
-        return SubscribeRecipeSerializer(
-            recipes,
-            many=True).data
+    def get_author(self, obj):
+        return obj
 
     def get_is_subscribed(self, obj):
-        subscribe = Subscription.objects.filter(
+        if hasattr(obj, 'subscribed'):
+            return obj.subscribed
+        return Subscription.objects.filter(
             user=self.context.get('request').user,
             author=obj
-        )
-        if subscribe:
-            return True
-        return False
+        ).exists()
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """ Список id рецептов для пакетных операций. """
+    MAX_IDS = 100
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_IDS,
+    )
+
+    def validate_ids(self, value):
+        # Порядок сохраняется, повторы отбрасываются.
+        return list(dict.fromkeys(value))
@@ -0,0 +1,155 @@
+import csv
+import hashlib
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connections
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from recipes.models import ShoppingListItem
+
+FONT_NAME = 'DejaVuSans'
+FONT_FILE = 'DejaVuSans.ttf'
+TITLE = 'Список ингредиентов'
+TITLE_FONT_SIZE = 24
+ROW_FONT_SIZE = 16
+ROW_HEIGHT = 25
+TOP = 800
+BOTTOM = 50
+LEFT = 75
+CACHE_PREFIX = 'shopping_list_pdf'
+CACHE_TIMEOUT = 60 * 60
+CHUNK_SIZE = 2000
+CSV_HEADER = ('name', 'measurement_unit', 'amount')
+
+_font_lock = threading.Lock()
+
+
+def register_fonts():
+    """ Регистрирует шрифт один раз на процесс. """
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return
+    with _font_lock:
+        if FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE, 'UTF-8'))
+
+
+def shopping_list_queryset(user):
+    """ Строки материализованного списка покупок пользователя. """
+    return ShoppingListItem.objects.filter(
+        user=user
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    )
+
+
+def get_shopping_list(user):
+    return list(shopping_list_queryset(user))
+
+
+def iter_shopping_list(user):
+    """ Строки списка через серверный курсор, без загрузки в память. """
+    return shopping_list_queryset(user).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    """ Псевдобуфер для csv.writer: возвращает записанную строку. """
+    def write(self, value):
+        return value
+
+
+def stream_txt(rows):
+    for i, (name, measurement_unit, amount) in enumerate(rows, 1):
+        yield f'{i}. {name} - {amount}, {measurement_unit}\n'
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_json(rows):
+    yield '['
+    for i, row in enumerate(rows):
+        item = json.dumps(dict(zip(CSV_HEADER, row)), ensure_ascii=False)
+        yield item if i == 0 else ',' + item
+    yield ']'
+
+
+async def iterate_in_thread(iterable, batch_size=CHUNK_SIZE):
+    """
+    Асинхронная обёртка над синхронной выгрузкой для ASGI.
+
+    Без неё Django собирает синхронный итератор в список целиком.
+    Итератор читается пачками в собственном потоке выгрузки: серверный
+    курсор остаётся на одном соединении, которое закрывается в конце.
+    """
+    executor = ThreadPoolExecutor(max_workers=1,
+                                  thread_name_prefix='export')
+    iterator = iter(iterable)
+
+    def next_batch():
+        return ''.join(islice(iterator, batch_size))
+
+    fetch = sync_to_async(next_batch, thread_sensitive=False,
+                          executor=executor)
+    try:
+        while batch := await fetch():
+            yield batch
+    finally:
+        await sync_to_async(connections.close_all, thread_sensitive=False,
+                            executor=executor)()
+        executor.shutdown(wait=False)
+
+
+STREAMS = {
+    'txt': stream_txt,
+    'csv': stream_csv,
+    'json': stream_json,
+}
+
+
+def render_pdf(rows):
+    """ Рисует список на стольких страницах, сколько нужно. """
+    register_fonts()
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer, pagesize=A4)
+    page.setFont(FONT_NAME, size=TITLE_FONT_SIZE)
+    page.drawString(200, TOP, TITLE)
+    page.setFont(FONT_NAME, size=ROW_FONT_SIZE)
+    height = TOP - 2 * ROW_HEIGHT
+    for i, (name, measurement_unit, amount) in enumerate(rows, 1):
+        if height < BOTTOM:
+            page.showPage()
+            page.setFont(FONT_NAME, size=ROW_FONT_SIZE)
+            height = TOP
+        page.drawString(LEFT, height,
+                        f'<{i}> {name} - {amount}, {measurement_unit}')
+        height -= ROW_HEIGHT
+    page.showPage()
+    page.save()
+    return buffer.getvalue()
+
+
+def get_shopping_list_pdf(user):
+    """ PDF корзины; одинаковые корзины рендерятся один раз. """
+    rows = get_shopping_list(user)
+    digest = hashlib.sha256(repr(rows).encode('utf-8')).hexdigest()
+    key = f'{CACHE_PREFIX}:{digest}'
+    pdf = cache.get(key)
+    if pdf is None:
+        pdf = render_pdf(rows)
+        cache.set(key, pdf, CACHE_TIMEOUT)
+    return pdf
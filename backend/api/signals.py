@@ -0,0 +1,100 @@
+from functools import partial
+
+from django.db import connections, transaction
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import authentication, ingredient_search
+from api.catalogs import tag_catalog
+from api.versions import bump_version, profile_version
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import ensure_sqlite_index
+from recipes.services import (change_counter, release_user_counters,
+                              remove_from_all_shopping_lists)
+from users.models import User
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_search.invalidate()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_catalog(**kwargs):
+    tag_catalog.invalidate()
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(instance, **kwargs):
+    # Корзины с рецептом удаляются каскадом, в том числе вместе с автором,
+    # поэтому его ингредиенты вычитаются здесь, пока строки ещё есть.
+    remove_from_all_shopping_lists(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(instance, **kwargs):
+    authentication.invalidate(instance.key)
+
+
+# Поля, изменение которых должно сразу отозвать доступ во всех воркерах.
+CREDENTIAL_FIELDS = ('password', 'is_active')
+# Поля автора в ответе рецепта: их изменение меняет ETag его рецептов.
+PROFILE_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def remember_user_changes(instance, update_fields=None, **kwargs):
+    if instance._state.adding:
+        return
+    fields = CREDENTIAL_FIELDS + PROFILE_FIELDS
+    if update_fields is not None:
+        fields = tuple(field for field in fields if field in update_fields)
+    stored = {}
+    if fields:
+        stored = dict(zip(fields, User.objects.filter(
+            pk=instance.pk
+        ).values_list(*fields).first() or ()))
+    changed = {field for field in fields
+               if stored.get(field) != getattr(instance, field)}
+    instance._credentials_changed = bool(changed & set(CREDENTIAL_FIELDS))
+    instance._profile_changed = bool(changed & set(PROFILE_FIELDS))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_caches(instance, created, **kwargs):
+    if created:
+        return
+    authentication.invalidate_user(
+        instance.pk,
+        everywhere=getattr(instance, '_credentials_changed', True)
+    )
+    if getattr(instance, '_profile_changed', True):
+        transaction.on_commit(
+            partial(bump_version, profile_version(instance.pk))
+        )
+
+
+@receiver(pre_delete, sender=User)
+def release_deleted_user_counters(instance, **kwargs):
+    release_user_counters(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(instance, **kwargs):
+    authentication.invalidate_user(instance.pk, everywhere=True)
+
+
+@receiver(post_migrate)
+def restore_recipe_search_index(app_config, using, **kwargs):
+    connection = connections[using]
+    if app_config.label == 'recipes' and connection.vendor == 'sqlite':
+        ensure_sqlite_index(connection)
@@ -0,0 +1,625 @@
+import base64
+from unittest import mock
+
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import (AsyncClient, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api import ingredient_search
+from api.authentication import (AUTH_VERSION, CachedTokenAuthentication,
+                                credentials_cache)
+from api.catalogs import TAGS_VERSION, build_tag_catalog, tag_catalog
+from api.filters import ORDERINGS
+from api.serializers import RecipeSerializer
+from api.versions import bump_version, get_version
+from foodgram import replica
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
+                            ListCart, Recipe, ShoppingListItem, Tag)
+from recipes.search import search_recipes
+from recipes.services import (change_counter, compute_shopping_lists,
+                              reconcile_counters)
+
+from recipes.tests import locmem_caches, png_header
+from users.models import Subscription, User
+
+
+def setUpModule():
+    locmem_caches.enable()
+
+
+def tearDownModule():
+    locmem_caches.disable()
+
+
+def create_recipe(author, amounts):
+    recipe = Recipe.objects.create(
+        author=author, name='Рецепт', text='...', cooking_time=10,
+        image='recipes/images/r.png',
+    )
+    IngredientInRecipe.objects.bulk_create(
+        IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                           amount=amount)
+        for ingredient, amount in amounts.items()
+    )
+    change_counter(User, author.pk, 'recipes_count', 1)
+    return recipe
+
+
+def stored_shopping_lists():
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in
+        ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        )
+    }
+
+
+class ApiTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='cook', email='cook@example.com', password='secret',
+            first_name='Имя', last_name='Фамилия',
+        )
+
+
+class DownloadShoppingCartTests(ApiTestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    def test_unauthorized_error_is_json(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', response.json())
+
+    def test_unknown_format_error_is_json(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, {'format': 'docx'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_pdf_is_default(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+
+class RecipeImageTests(ApiTestCase):
+    def test_oversized_image_is_validation_error(self):
+        self.client.force_authenticate(self.user)
+        image = base64.b64encode(png_header(10000, 9000)).decode()
+        response = self.client.post('/api/recipes/', {
+            'name': 'Пирог', 'text': 'Испечь', 'cooking_time': 10,
+            'image': f'data:image/png;base64,{image}',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.json())
+
+
+class VersionCacheTests(SimpleTestCase):
+    def test_tests_do_not_use_file_cache(self):
+        for alias in ('default', 'versions'):
+            self.assertIsInstance(caches[alias], LocMemCache)
+
+    def test_versions_survive_default_cache_clear(self):
+        version = bump_version('tests')
+        cache.clear()
+        self.assertEqual(get_version('tests'), version)
+
+
+@override_settings(DATABASE_ROUTERS=['foodgram.replica.ReplicaRouter'])
+class SnapshotReplicaTests(SimpleTestCase):
+    databases = {'default'}
+
+    def test_snapshots_are_built_from_primary(self):
+        # Реплики в тестах нет: чтение с неё завершилось бы ошибкой.
+        token = replica._use_replica.set(True)
+        try:
+            build_tag_catalog()
+            ingredient_search.build_index()
+        finally:
+            replica._use_replica.reset(token)
+
+
+class CatalogVersionTests(TestCase):
+    def test_tag_version_changes_after_commit(self):
+        version = get_version(TAGS_VERSION)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Ужин', color='#8775D2', slug='dinner')
+            self.assertEqual(get_version(TAGS_VERSION), version)
+        self.assertNotEqual(get_version(TAGS_VERSION), version)
+        self.assertIn('dinner', tag_catalog.get().slug_ids)
+
+
+class RecipeUpdateCounterTests(ApiTestCase):
+    def test_patch_keeps_concurrent_favorite(self):
+        ingredient = Ingredient.objects.create(name='мука',
+                                               measurement_unit='г')
+        tag = Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        recipe = Recipe.objects.create(
+            author=self.user, name='Пирог', text='Испечь', cooking_time=10,
+            image='recipes/images/pie.png',
+        )
+        recipe.tags.add(tag)
+        IngredientInRecipe.objects.create(recipe=recipe,
+                                          ingredient=ingredient, amount=100)
+        validate = RecipeSerializer.validate
+
+        def favorite_meanwhile(serializer, value):
+            # Рецепт уже загружен представлением, сохранение ещё впереди.
+            change_counter(Recipe, recipe.pk, 'favorites_count', 1)
+            return validate(serializer, value)
+
+        self.client.force_authenticate(self.user)
+        with mock.patch.object(RecipeSerializer, 'validate',
+                               favorite_meanwhile):
+            response = self.client.patch(f'/api/recipes/{recipe.pk}/', {
+                'name': 'Пирог с яблоками',
+                'tags': [tag.pk],
+                'ingredients': [{'id': ingredient.pk, 'amount': 200}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Пирог с яблоками')
+        self.assertEqual(recipe.favorites_count, 1)
+
+
+class AsgiExportTests(TransactionTestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='secret'
+        )
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                user=self.user, amount=number,
+                ingredient=Ingredient.objects.create(
+                    name=f'продукт {number:02}', measurement_unit='г'
+                ),
+            )
+            for number in range(1, 6)
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    @override_settings(SERVER_INTERFACE='asgi')
+    async def test_exports_stream_asynchronously(self):
+        for export_format in ('txt', 'csv', 'json'):
+            with self.subTest(export_format=export_format):
+                response = await AsyncClient().get(
+                    self.url, {'format': export_format},
+                    headers={'Authorization': f'Token {self.token.key}'},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.is_async)
+                content = b''.join([
+                    chunk async for chunk in response.streaming_content
+                ]).decode()
+                self.assertIn('продукт 05', content)
+
+    @override_settings(SERVER_INTERFACE='wsgi')
+    def test_exports_stream_synchronously_under_wsgi(self):
+        response = self.client.get(
+            self.url, {'format': 'txt'},
+            headers={'Authorization': f'Token {self.token.key}'},
+        )
+        self.assertFalse(response.is_async)
+        self.assertIn('5. продукт 05 - 5, г',
+                      b''.join(response.streaming_content).decode())
+
+
+class TokenCacheTests(APITestCase):
+    def setUp(self):
+        credentials_cache.clear()
+        self.tokens = {}
+        for name in ('alice', 'bob'):
+            user = User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='secret'
+            )
+            token = Token.objects.create(user=user)
+            CachedTokenAuthentication().authenticate_credentials(token.key)
+            self.tokens[name] = (user, token.key)
+
+    def cached(self, name):
+        return credentials_cache.get(self.tokens[name][1]) is not None
+
+    def test_profile_edit_drops_only_own_entries(self):
+        version = get_version(AUTH_VERSION)
+        alice = self.tokens['alice'][0]
+        alice.first_name = 'Алиса'
+        with self.captureOnCommitCallbacks(execute=True):
+            alice.save()
+        self.assertFalse(self.cached('alice'))
+        self.assertTrue(self.cached('bob'))
+        self.assertEqual(get_version(AUTH_VERSION), version)
+
+    def test_password_change_invalidates_everywhere_on_commit(self):
+        version = get_version(AUTH_VERSION)
+        alice = self.tokens['alice'][0]
+        alice.set_password('changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            alice.save()
+            self.assertTrue(self.cached('alice'))
+            self.assertEqual(get_version(AUTH_VERSION), version)
+        self.assertNotEqual(get_version(AUTH_VERSION), version)
+
+    def test_logout_drops_token(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(key=self.tokens['bob'][1]).delete()
+        self.assertFalse(self.cached('bob'))
+
+
+class RecipeIdsTests(ApiTestCase):
+    url = '/api/recipes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipes = Recipe.objects.bulk_create(
+            Recipe(author=cls.user, name=f'Рецепт {number}', text='...',
+                   cooking_time=number, image='recipes/images/r.png')
+            for number in range(1, 9)
+        )
+
+    def test_ids_return_all_listed_recipes_unpaginated(self):
+        ids = [recipe.pk for recipe in self.recipes[:7]]
+        response = self.client.get(self.url, {
+            'ids': ','.join(map(str, ids)), 'fields': 'id'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(item['id'] for item in response.json()),
+                         ids)
+
+    def test_blank_ids_are_rejected(self):
+        for value in ('', ' ', ','):
+            with self.subTest(ids=value):
+                response = self.client.get(self.url, {'ids': value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('ids', response.json())
+
+    def test_too_many_ids_are_rejected(self):
+        response = self.client.get(self.url, {
+            'ids': ','.join(map(str, range(1, 102)))
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_without_ids_list_is_paginated(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['count'], 8)
+        self.assertEqual(len(response.json()['results']), 6)
+
+
+class ShoppingListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        cls.buyer = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='secret'
+        )
+        cls.tag = Tag.objects.create(name='Обед', color='#49B64E',
+                                     slug='lunch')
+        cls.flour, cls.sugar, cls.eggs = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар', 'яйца')
+        )
+        cls.pie = create_recipe(cls.author, {cls.flour: 100,
+                                             cls.sugar: 50})
+        cls.omelette = create_recipe(cls.buyer, {cls.flour: 30,
+                                                 cls.eggs: 2})
+
+    def add_to_cart(self, user, recipe):
+        self.client.force_authenticate(user)
+        response = self.client.post(
+            f'/api/recipes/{recipe.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def assertShoppingListsConsistent(self):
+        self.assertEqual(stored_shopping_lists(), compute_shopping_lists())
+
+    def test_add(self):
+        self.add_to_cart(self.buyer, self.pie)
+        self.add_to_cart(self.buyer, self.omelette)
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.buyer,
+                                         ingredient=self.flour).amount,
+            130
+        )
+        self.assertShoppingListsConsistent()
+
+    def test_remove(self):
+        self.add_to_cart(self.buyer, self.pie)
+        self.add_to_cart(self.buyer, self.omelette)
+        cart = ListCart.objects.get(user=self.buyer, recipe=self.pie)
+        response = self.client.delete(
+            f'/api/recipes/{self.pie.pk}/shopping_cart/{cart.pk}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertShoppingListsConsistent()
+        response = self.client.delete('/api/recipes/shopping_cart/',
+                                      {'ids': [self.omelette.pk]},
+                                      format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ShoppingListItem.objects.exists())
+        self.assertShoppingListsConsistent()
+
+    def test_update(self):
+        self.add_to_cart(self.buyer, self.pie)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(f'/api/recipes/{self.pie.pk}/', {
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.flour.pk, 'amount': 200},
+                            {'id': self.eggs.pk, 'amount': 3}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertShoppingListsConsistent()
+
+    def test_recipe_delete(self):
+        self.add_to_cart(self.buyer, self.pie)
+        self.add_to_cart(self.author, self.pie)
+        response = self.client.delete(f'/api/recipes/{self.pie.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(ShoppingListItem.objects.exists())
+        self.assertShoppingListsConsistent()
+
+    def test_author_delete(self):
+        self.add_to_cart(self.buyer, self.pie)
+        self.add_to_cart(self.buyer, self.omelette)
+        self.add_to_cart(self.author, self.omelette)
+        self.client.force_authenticate(self.author)
+        response = self.client.delete('/api/users/me/',
+                                      {'current_password': 'secret'},
+                                      format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(User.objects.filter(pk=self.author.pk).exists())
+        self.assertShoppingListsConsistent()
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.buyer,
+                                         ingredient=self.flour).amount,
+            30
+        )
+
+    def test_user_delete_releases_counters(self):
+        self.add_to_cart(self.buyer, self.pie)
+        self.client.post(f'/api/recipes/{self.pie.pk}/favorite/')
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertFalse(any(reconcile_counters().values()))
+        response = self.client.delete('/api/users/me/',
+                                      {'current_password': 'secret'},
+                                      format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(any(reconcile_counters().values()))
+
+    def test_favorite_destroy_route(self):
+        self.client.force_authenticate(self.buyer)
+        self.client.post(f'/api/recipes/{self.pie.pk}/favorite/')
+        favorite = Favorite.objects.get(user=self.buyer)
+        response = self.client.delete(
+            f'/api/recipes/{self.pie.pk}/favorite/{favorite.pk}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(any(reconcile_counters().values()))
+
+
+class RecipeValidatorTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Пирог', text='Испечь', cooking_time=10,
+            image='recipes/images/pie.png',
+        )
+
+    def get(self, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(f'/api/recipes/{self.recipe.pk}/',
+                               headers=headers)
+
+    def test_author_rename_changes_etag(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(etag).status_code, 304)
+        self.user.first_name = 'Повар'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['author']['first_name'], 'Повар')
+
+    def test_last_login_keeps_etag(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, self.user)
+        self.assertEqual(self.get(etag).status_code, 304)
+
+
+class KeysetPaginationTests(ApiTestCase):
+    url = '/api/recipes/'
+    # Предохранитель от бесконечного обхода, если курсор не продвигается.
+    MAX_PAGES = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Повторяющиеся ключи сортировки: порядок внутри них решает id.
+        Recipe.objects.bulk_create(
+            Recipe(author=cls.user, name=f'Пирог {number}',
+                   text='пирог ' * (number % 3 + 1) + 'с начинкой',
+                   cooking_time=number % 4 + 1,
+                   favorites_count=number % 3,
+                   image='recipes/images/r.png')
+            for number in range(15)
+        )
+
+    def walk(self, params):
+        """ Все страницы вперёд, затем назад с последней. """
+        response = self.client.get(self.url, {**params, 'cursor': '',
+                                              'limit': 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['previous'])
+        pages = [response.json()]
+        while pages[-1]['next']:
+            self.assertLess(len(pages), self.MAX_PAGES)
+            pages.append(self.client.get(pages[-1]['next']).json())
+        backward = [pages[-1]]
+        while backward[-1]['previous']:
+            self.assertLess(len(backward), self.MAX_PAGES)
+            backward.append(self.client.get(backward[-1]['previous']).json())
+        return (
+            [[item['id'] for item in page['results']] for page in pages],
+            [[item['id'] for item in page['results']]
+             for page in reversed(backward)],
+        )
+
+    def assertWalks(self, params, expected):
+        forward, backward = self.walk(params)
+        self.assertEqual([len(page) for page in forward], [4, 4, 4, 3])
+        self.assertEqual(sum(forward, []), expected)
+        self.assertEqual(backward, forward)
+
+    def test_orderings(self):
+        for ordering, fields in ORDERINGS.items():
+            with self.subTest(ordering=ordering):
+                self.assertWalks(
+                    {'ordering': ordering},
+                    list(Recipe.objects.order_by(*fields).values_list(
+                        'id', flat=True
+                    ))
+                )
+
+    def test_default_ordering(self):
+        self.assertWalks({}, list(Recipe.objects.values_list('id',
+                                                             flat=True)))
+
+    def test_search_rank(self):
+        expected = list(search_recipes(
+            Recipe.objects.all(), 'пирог'
+        ).values_list('id', flat=True))
+        self.assertEqual(len(expected), 15)
+        self.assertWalks({'search': 'пирог'}, expected)
+
+    def test_last_page_has_no_next(self):
+        forward = self.client.get(self.url, {'cursor': '', 'limit': 15})
+        self.assertIsNone(forward.json()['next'])
+        self.assertIsNone(forward.json()['previous'])
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', base64.urlsafe_b64encode(
+                b'{"v": [1], "r": 0}').decode()):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_subscriptions(self):
+        authors = User.objects.bulk_create(
+            User(username=f'author{number}',
+                 email=f'author{number}@example.com')
+            for number in range(5)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(user=self.user, author=author) for author in authors
+        )
+        self.client.force_authenticate(self.user)
+        self.url = '/api/users/subscriptions/'
+        forward, backward = self.walk({})
+        self.assertEqual(sum(forward, []),
+                         [author.pk for author in reversed(authors)])
+        self.assertEqual(backward, forward)
+
+
+class BatchRecipesTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'продукт {number}', measurement_unit='г')
+            for number in range(6)
+        )
+        cls.recipes = [
+            create_recipe(cls.user, {
+                ingredient: number + 1
+                for ingredient in ingredients[number % 3:number % 3 + 3]
+            })
+            for number in range(12)
+        ]
+        cls.missing = max(recipe.pk for recipe in cls.recipes) + 1
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def batch(self, method, url, ids):
+        if method == 'get':
+            response = self.client.get(url, {'ids': ','.join(map(str, ids))})
+        else:
+            response = getattr(self.client, method)(url, {'ids': ids},
+                                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item['status']
+                for item in response.json()['results']}
+
+    def assertConsistent(self):
+        self.assertEqual(stored_shopping_lists(), compute_shopping_lists())
+        self.assertFalse(any(reconcile_counters().values()))
+
+    def test_statuses_and_deltas(self):
+        first, second, third = (recipe.pk for recipe in self.recipes[:3])
+        for url, field in (('/api/recipes/shopping_cart/', 'in_carts_count'),
+                           ('/api/recipes/favorite/', 'favorites_count')):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.batch('post', url, [first, second, self.missing]),
+                    {first: 'added', second: 'added',
+                     self.missing: 'not_found'}
+                )
+                self.assertEqual(
+                    self.batch('post', url, [second, third]),
+                    {second: 'exists', third: 'added'}
+                )
+                self.assertEqual(
+                    getattr(Recipe.objects.get(pk=second), field), 1
+                )
+                self.assertConsistent()
+                self.assertEqual(
+                    self.batch('get', url, [first, self.missing]),
+                    {first: 'present', self.missing: 'not_found'}
+                )
+                self.assertEqual(
+                    self.batch('delete', url, [first, self.missing]),
+                    {first: 'removed', self.missing: 'absent'}
+                )
+                self.assertEqual(
+                    self.batch('get', url, [first, third]),
+                    {first: 'absent', third: 'present'}
+                )
+                self.assertEqual(
+                    getattr(Recipe.objects.get(pk=first), field), 0
+                )
+                self.assertConsistent()
+        self.assertEqual(
+            set(ShoppingListItem.objects.values_list('user_id', flat=True)),
+            {self.user.pk}
+        )
+
+    def test_statement_count_does_not_grow_with_ids(self):
+        url = '/api/recipes/shopping_cart/'
+        # Число запросов одно и то же для 2 и для 10 рецептов. В POST:
+        # две точки сохранения (4 запроса), блокировка пользователя,
+        # рецепты, корзина, вставка, счётчики, ингредиенты, строки
+        # списка покупок и их количества. В DELETE вместо вставок -
+        # удаление из корзины и очистка нулевых строк.
+        for ids in (self.recipes[:2], self.recipes[2:]):
+            ids = [recipe.pk for recipe in ids]
+            with self.assertNumQueries(2):
+                self.batch('get', url, ids)
+            with self.assertNumQueries(12):
+                self.batch('post', url, ids)
+            with self.assertNumQueries(11):
+                self.batch('delete', url, ids)
+        self.assertConsistent()
@@ -0,0 +1,84 @@
+"""
+Версии коллекций в общем кэше.
+
+Версия - отметка времени в наносекундах последнего изменения коллекции.
+По ней процессы узнают, что их локальные данные устарели, а ответы
+получают ETag и Last-Modified без сериализации.
+"""
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+KEY_PREFIX = 'version'
+CHECK_INTERVAL = 5
+# Отдельный кэш без вытеснения: потерянная версия сбросилась бы
+# и вернула устаревшие ETag.
+CACHE_ALIAS = 'versions'
+
+
+def get_version(name):
+    cache = caches[CACHE_ALIAS]
+    return cache.get_or_set(f'{KEY_PREFIX}:{name}', time.time_ns, None)
+
+
+def bump_version(name):
+    cache = caches[CACHE_ALIAS]
+    key = f'{KEY_PREFIX}:{name}'
+    version = max(time.time_ns(), (cache.get(key) or 0) + 1)
+    cache.set(key, version, None)
+    return version
+
+
+def profile_version(user_id):
+    """ Имя версии профиля пользователя, который виден как автор. """
+    return f'profile:{user_id}'
+
+
+def version_timestamp(version):
+    """ Версия в секундах для заголовка Last-Modified. """
+    return version // 1_000_000_000
+
+
+class VersionedSnapshot:
+    """
+    Локальная для процесса копия данных, собираемая функцией build.
+
+    Версия в общем кэше проверяется не чаще раза в CHECK_INTERVAL секунд;
+    если другой процесс её сменил, копия пересобирается.
+    """
+
+    def __init__(self, name, build, check_interval=CHECK_INTERVAL):
+        self.name = name
+        self.build = build
+        self.check_interval = check_interval
+        self._value = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if (self._value is not None
+                and now - self._checked_at < self.check_interval):
+            return self._value
+        version = get_version(self.name)
+        with self._lock:
+            if self._value is None or self._version != version:
+                self._value = self.build()
+                self._version = version
+            self._checked_at = now
+        return self._value
+
+    def invalidate(self):
+        """
+        Сбрасывает копию здесь и, через версию, во всех процессах, когда
+        транзакция зафиксирована: иначе другой процесс успел бы собрать
+        копию из старых строк и сохранить её под новой версией.
+        """
+        transaction.on_commit(self._invalidate)
+
+    def _invalidate(self):
+        bump_version(self.name)
+        self._value = None
@@ -1,30 +1,43 @@
+import io
 import logging
+from functools import partial
 
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
-
-from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 
 from djoser.views import UserViewSet
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
-                            ListCart, Recipe, Tag)
+                            ListCart, Recipe, ShoppingListItem, Tag)
+from recipes.services import (add_recipes, add_to_shopping_list,
+                              change_counter, check_recipes, remove_recipes,
+                              remove_from_shopping_list)
 from users.models import Subscription, User
 
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
-from api.filters import IngredientFilter, RecipesFilter
-from api.mixins import CreateDestroyViewSet
+from api import ingredient_search
+from api.catalogs import TAGS_VERSION, tag_catalog
+from api.filters import RecipesFilter
+from api.mixins import (AsyncReadMixin, ConditionalGetMixin,
+                        CreateDestroyViewSet, make_etag)
 from api.paginations import CustomPagination
+from api.renderers import (CSVRenderer, ExportRenderer, PDFRenderer,
+                           PlainTextRenderer)
+from api.shopping_list import (STREAMS, get_shopping_list_pdf,
+                               iter_shopping_list, iterate_in_thread)
+from api.versions import get_version, profile_version, version_timestamp
 from .serializers import (FavoriteSerializer, IngredientSerializer,
-                          ListCartSerializer,
-                          RecipeSerializer,
+                          ListCartSerializer, RecipeIdsSerializer,
+                          RecipeSerializer, ShoppingListItemSerializer,
                           SubscriptionsSerializer, TagSerializer,
                           UsersSerializer, UserSubscriptionsSerializer)
 
@@ -32,19 +45,45 @@ from .serializers import (FavoriteSerializer, IngredientSerializer,
 logger = logging.getLogger(__name__)
 
 
-class UsersViewSet(UserViewSet):
+class UsersViewSet(AsyncReadMixin, UserViewSet):
     """ Вьюсет для работы с пользователями """
     queryset = User.objects.all()
     serializer_class = UsersSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = CustomPagination
     http_method_names = ['get', 'post', 'delete', 'head']
+    async_actions = ('list', 'retrieve', 'subscriptions')
 
     def get_permissions(self):
         if self.action == 'me':
             self.permission_classes = (IsAuthenticated,)
         return super().get_permissions()
 
+    def get_recipes_limit(self):
+        limit = self.request.query_params.get('recipes_limit')
+        if limit is None:
+            return None
+        try:
+            return max(int(limit), 0)
+        except ValueError:
+            raise ValidationError({'recipes_limit': 'Ожидается целое число'})
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['recipes_limit'] = self.get_recipes_limit()
+        return context
+
+    def latest_recipes(self, lookup):
+        """ Последние recipes_limit рецептов каждого автора одним запросом. """
+        queryset = Recipe.objects.only(
+            'id', 'author_id', 'name', 'image', 'renditions', 'cooking_time',
+            'pub_date'
+        ).order_by('-pub_date', '-id')
+        limit = self.get_recipes_limit()
+        if limit is not None:
+            queryset = queryset[:limit]
+        return Prefetch(lookup, queryset=queryset, to_attr='latest_recipes')
+
     @action(methods=['POST', 'DELETE'],
             detail=True, )
     def subscribe(self, request, id):
@@ -54,16 +93,24 @@ class UsersViewSet(UserViewSet):
             user=user, author=author)
 
         if request.method == 'POST':
+            with transaction.atomic():
+                Subscription.objects.create(user=user, author=author)
+                change_counter(User, author.id, 'followers_count', 1)
+            author = User.objects.prefetch_related(
+                self.latest_recipes('recipe')
+            ).get(id=author.id)
+            author.subscribed = True
             serializer = UserSubscriptionsSerializer(
                 author,
-                context={'request': request}
+                context=self.get_serializer_context()
             )
-            Subscription.objects.create(user=user, author=author)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            if subscription.exists():
-                subscription.delete()
+            with transaction.atomic():
+                deleted, _ = subscription.delete()
+                change_counter(User, author.id, 'followers_count', -deleted)
+            if deleted:
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response({'error': 'Вы не подписаны на этого пользователя'},
                             status=status.HTTP_400_BAD_REQUEST)
@@ -71,78 +118,324 @@ class UsersViewSet(UserViewSet):
     @action(detail=False, permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
         user = request.user
-        follows = Subscription.objects.filter(user=user)
+        follows = Subscription.objects.filter(
+            user=user
+        ).select_related('author').prefetch_related(
+            self.latest_recipes('author__recipe')
+        ).order_by('-id')
         page = self.paginate_queryset(follows)
         serializer = SubscriptionsSerializer(
             page, many=True,
-            context={'request': request})
+            context=self.get_serializer_context())
         return self.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AsyncReadMixin, ConditionalGetMixin,
+                    viewsets.ModelViewSet):
     """ Вьюсет для рецептов. """
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = CustomPagination
     queryset = Recipe.objects.all()
     filterset_class = RecipesFilter
+    async_actions = ('list', 'retrieve', 'shopping_list',
+                     'download_shopping_cart')
+
+    # Столбцы рецепта, нужные полям ответа. Ключи сортировки читаются
+    # всегда: по ним keyset-пагинация строит курсор.
+    FIELD_COLUMNS = {
+        'author': ('author',),
+        'name': ('name',),
+        'image': ('image',),
+        'images': ('renditions',),
+        'text': ('text',),
+        'cooking_time': ('cooking_time',),
+    }
+    ORDERING_COLUMNS = ('id', 'pub_date', 'cooking_time', 'favorites_count')
+
+    def get_requested_fields(self):
+        """
+        Поля из ?fields=name,image для чтения, None - все поля.
+        Ненужные столбцы, prefetch и подзапросы тогда не выполняются.
+        """
+        value = self.request.query_params.get('fields')
+        if self.request.method not in ('GET', 'HEAD') or not value:
+            return None
+        fields = {name.strip() for name in value.split(',') if name.strip()}
+        unknown = fields - set(RecipeSerializer.Meta.fields)
+        if unknown:
+            raise ValidationError({
+                'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}'
+            })
+        return fields
+
+    def get_queryset(self):
+        fields = self.get_requested_fields()
+
+        def wanted(name):
+            return fields is None or name in fields
+
+        queryset = Recipe.objects.all()
+        if fields is not None:
+            queryset = queryset.only(*self.ORDERING_COLUMNS, *(
+                column for name in fields
+                for column in self.FIELD_COLUMNS.get(name, ())
+            ))
+        if wanted('tags'):
+            queryset = queryset.prefetch_related('tags')
+        if wanted('ingredients'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'ingredientinrecipe_set',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            ))
+        user = self.request.user
+        if not user.is_authenticated:
+            if wanted('author'):
+                queryset = queryset.select_related('author')
+            return queryset
+        if wanted('author'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'author',
+                queryset=User.objects.annotate(
+                    subscribed=Exists(Subscription.objects.filter(
+                        user=user, author=OuterRef('pk')
+                    ))
+                )
+            ))
+        return self.annotate_user_flags(queryset, fields)
+
+    def annotate_user_flags(self, queryset, fields=None):
+        user = self.request.user
+        flags = {
+            'is_favorited': Favorite,
+            'is_in_shopping_cart': ListCart,
+        }
+        return queryset.annotate(**{
+            name: Exists(model.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+            for name, model in flags.items()
+            if fields is None or name in fields
+        })
+
+    def paginate_queryset(self, queryset):
+        # Набор ?ids= (не больше MAX_IDS, проверен фильтром) отдаётся
+        # целиком.
+        if getattr(self.request, 'recipe_ids', None):
+            return None
+        return super().paginate_queryset(queryset)
+
+    def get_recipe_validators(self, pk):
+        """ ETag и Last-Modified рецепта без его сериализации. """
+        if not str(pk).isdigit():
+            return None, None
+        user = self.request.user
+        queryset = Recipe.objects.filter(pk=pk)
+        fields = ['updated_at', 'author_id']
+        if user.is_authenticated:
+            queryset = self.annotate_user_flags(queryset).annotate(
+                author_subscribed=Exists(Subscription.objects.filter(
+                    user=user, author=OuterRef('author')
+                ))
+            )
+            fields += ['is_favorited', 'is_in_shopping_cart',
+                       'author_subscribed']
+        row = queryset.values_list(*fields).first()
+        if row is None:
+            return None, None
+        versions = (
+            get_version(TAGS_VERSION),
+            get_version(ingredient_search.VERSION_NAME),
+            get_version(profile_version(row[1])),
+        )
+        requested = self.get_requested_fields()
+        etag = make_etag('recipe', pk, user.id, *row, *versions,
+                         sorted(requested or ()))
+        if user.is_authenticated:
+            return etag, None
+        return etag, max(int(row[0].timestamp()),
+                         *map(version_timestamp, versions))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            self.get_recipe_validators(kwargs[self.lookup_field]),
+            partial(super().retrieve, request, *args, **kwargs)
+        )
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        context.update({'request': self.request})
+        context.update({'request': self.request,
+                        'fields': self.get_requested_fields()})
         return context
 
+    def batch_response(self, request, model):
+        """
+        Пакетная работа с избранным или корзиной: GET ?ids=1,2 проверяет,
+        POST добавляет, DELETE убирает рецепты из тела {"ids": [...]}.
+        """
+        if request.method == 'GET':
+            data = {'ids': [
+                value for value in
+                request.query_params.get('ids', '').split(',') if value
+            ]}
+        else:
+            data = request.data
+        serializer = RecipeIdsSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        operation = {
+            'GET': check_recipes,
+            'POST': add_recipes,
+            'DELETE': remove_recipes,
+        }[request.method]
+        results = operation(model, request.user.id, ids)
+        return Response({'results': [
+            {'id': pk, 'status': result} for pk, result in results.items()
+        ]})
+
+    @action(detail=False, methods=['get', 'post', 'delete'],
+            url_path='favorite', permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        return self.batch_response(request, Favorite)
+
+    @action(detail=False, methods=['get', 'post', 'delete'],
+            url_path='shopping_cart', permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        return self.batch_response(request, ListCart)
+
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated])
+    def shopping_list(self, request):
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by('ingredient__name')
+        serializer = ShoppingListItemSerializer(items, many=True)
+        return Response(serializer.data)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Ошибки выгрузки (401, неверный format) отдаются в JSON, а не
+        # с типом файла: PDFRenderer стоит первым как формат по умолчанию.
+        if (isinstance(response, Response) and response.status_code >= 400
+                and isinstance(getattr(request, 'accepted_renderer', None),
+                               (ExportRenderer, type(None)))):
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[PDFRenderer, PlainTextRenderer,
+                              CSVRenderer, JSONRenderer])
     def download_shopping_cart(self, request):
-        final_list = {}
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__recipe_shopping_cart__user=request.user).values_list(
-            'ingredient__name', 'ingredient__measurement_unit',
-            'amount')
-        for item in ingredients:
-            name = item[0]
-            if name not in final_list:
-                final_list[name] = {
-                    'measurement_unit': item[1],
-                    'amount': item[2]
-                }
-            else:
-                final_list[name]['amount'] += item[2]
-        pdfmetrics.registerFont(
-            TTFont('DejaVuSans', 'DejaVuSans.ttf', 'UTF-8'))
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = ('attachment; '
-                                           'filename="shopping_list.pdf"')
-        page = canvas.Canvas(response)
-        page.setFont('DejaVuSans', size=24)
-        page.drawString(200, 800, 'Список ингредиентов')
-        page.setFont('DejaVuSans', size=16)
-        height = 750
-        for i, (name, data) in enumerate(final_list.items(), 1):
-            page.drawString(75, height, (f'<{i}> {name} - {data["amount"]}, '
-                                         f'{data["measurement_unit"]}'))
-            height -= 25
-        page.showPage()
-        page.save()
-        return response
-
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
-    """ Вьюсет для ингредиентов. """
-    queryset = Ingredient.objects.all()
-    serializer_class = IngredientSerializer
+        export_format = request.accepted_renderer.format
+        if export_format in STREAMS:
+            content = STREAMS[export_format](iter_shopping_list(request.user))
+            if settings.SERVER_INTERFACE == 'asgi':
+                content = iterate_in_thread(content)
+            response = StreamingHttpResponse(
+                content,
+                content_type=(f'{request.accepted_renderer.media_type}; '
+                              f'charset=utf-8'),
+            )
+            response['Content-Disposition'] = (
+                f'attachment; filename="shopping_list.{export_format}"'
+            )
+            return response
+        return FileResponse(
+            io.BytesIO(get_shopping_list_pdf(request.user)),
+            as_attachment=True,
+            filename='shopping_list.pdf',
+            content_type='application/pdf',
+        )
+
+
+class CatalogViewSet(AsyncReadMixin, ConditionalGetMixin,
+                     viewsets.ReadOnlyModelViewSet):
+    """ Справочник, версия которого меняется сигналами моделей. """
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
     pagination_class = None
+    version_name = None
+
+    def get_catalog_validators(self, request):
+        version = get_version(self.version_name)
+        return (
+            make_etag(self.version_name, version, self.action,
+                      self.kwargs.get(self.lookup_field),
+                      sorted(request.query_params.lists())),
+            version_timestamp(version)
+        )
 
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            self.get_catalog_validators(request),
+            partial(self.list_response, request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            self.get_catalog_validators(request),
+            partial(self.retrieve_response, request, *args, **kwargs)
+        )
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    def list_response(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def retrieve_response(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def get_catalog_id(self):
+        try:
+            return int(self.kwargs[self.lookup_field])
+        except ValueError:
+            raise NotFound
+
+
+class IngredientViewSet(CatalogViewSet):
+    """ Вьюсет для ингредиентов. """
+    queryset = Ingredient.objects.all()
+    serializer_class = IngredientSerializer
+    version_name = ingredient_search.VERSION_NAME
+
+    def list_response(self, request, *args, **kwargs):
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            try:
+                limit = max(int(limit), 0)
+            except ValueError:
+                raise ValidationError({'limit': 'Ожидается целое число'})
+        name = request.query_params.get('name', '')
+        if not name and limit is None:
+            return HttpResponse(ingredient_search.get_index().content,
+                                content_type='application/json')
+        return Response(ingredient_search.search(name, limit))
+
+    def retrieve_response(self, request, *args, **kwargs):
+        ingredient = ingredient_search.get_index().get(self.get_catalog_id())
+        if ingredient is None:
+            raise NotFound
+        return Response(ingredient)
+
+
+class TagViewSet(CatalogViewSet):
     """ Вьюсет для тегов. """
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    permission_classes = (IsAuthenticatedOrReadOnly,)
-    pagination_class = None
+    version_name = TAGS_VERSION
+
+    def list_response(self, request, *args, **kwargs):
+        return HttpResponse(tag_catalog.get().content,
+                            content_type='application/json')
+
+    def retrieve_response(self, request, *args, **kwargs):
+        content = tag_catalog.get().items.get(self.get_catalog_id())
+        if content is None:
+            raise NotFound
+        return HttpResponse(content, content_type='application/json')
 
 
 class SubscribeViewSet(CreateDestroyViewSet):
@@ -167,14 +460,16 @@ class SubscribeViewSet(CreateDestroyViewSet):
         context['author_id'] = self.kwargs.get('user_id')
         return context
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(
+        subscription = serializer.save(
             user=self.request.user,
             author=get_object_or_404(
                 User,
                 id=self.kwargs.get('user_id')
             )
         )
+        change_counter(User, subscription.author_id, 'followers_count', 1)
 
     @action(methods=('delete',), detail=True)
     def delete(self, request, user_id):
@@ -183,11 +478,13 @@ class SubscribeViewSet(CreateDestroyViewSet):
                 user=request.user, author_id=user_id).exists():
             return Response({'errors': 'Вы не были подписаны на автора'},
                             status=status.HTTP_400_BAD_REQUEST)
-        get_object_or_404(
-            Subscription,
-            user=request.user,
-            author_id=user_id
-        ).delete()
+        with transaction.atomic():
+            get_object_or_404(
+                Subscription,
+                user=request.user,
+                author_id=user_id
+            ).delete()
+            change_counter(User, user_id, 'followers_count', -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -204,14 +501,19 @@ class FavoriteRecipeViewSet(CreateDestroyViewSet):
         context['recipe_id'] = self.kwargs.get('recipe_id')
         return context
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(
+        favorite = serializer.save(
             user=self.request.user,
             recipe=get_object_or_404(
                 Recipe,
                 id=self.kwargs.get('recipe_id')
             )
         )
+        change_counter(Recipe, favorite.recipe_id, 'favorites_count', 1)
+
+    def perform_destroy(self, instance):
+        remove_recipes(Favorite, instance.user_id, [instance.recipe_id])
 
     @action(methods=('delete',), detail=True)
     def delete(self, request, recipe_id):
@@ -221,10 +523,12 @@ class FavoriteRecipeViewSet(CreateDestroyViewSet):
                     recipe_id=recipe_id).exists():
             return Response({'errors': 'Рецепт не в избранном'},
                             status=status.HTTP_400_BAD_REQUEST)
-        get_object_or_404(
-            Favorite,
-            user=request.user,
-            recipe_id=recipe_id).delete()
+        with transaction.atomic():
+            get_object_or_404(
+                Favorite,
+                user=request.user,
+                recipe_id=recipe_id).delete()
+            change_counter(Recipe, recipe_id, 'favorites_count', -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -241,14 +545,20 @@ class ListCartViewSet(CreateDestroyViewSet):
         context['recipe_id'] = self.kwargs.get('recipe_id')
         return context
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(
+        cart = serializer.save(
             user=self.request.user,
             recipe=get_object_or_404(
                 Recipe,
                 id=self.kwargs.get('recipe_id')
             )
         )
+        add_to_shopping_list(cart.user_id, cart.recipe)
+        change_counter(Recipe, cart.recipe_id, 'in_carts_count', 1)
+
+    def perform_destroy(self, instance):
+        remove_recipes(ListCart, instance.user_id, [instance.recipe_id])
 
     @action(methods=('delete',), detail=True)
     def delete(self, request, recipe_id):
@@ -258,8 +568,12 @@ class ListCartViewSet(CreateDestroyViewSet):
                     recipe_id=recipe_id).exists():
             return Response({'errors': 'Рецепта нет в корзине'},
                             status=status.HTTP_400_BAD_REQUEST)
-        get_object_or_404(
+        cart = get_object_or_404(
             ListCart,
             user=request.user,
-            recipe=recipe_id).delete()
+            recipe=recipe_id)
+        with transaction.atomic():
+            cart.delete()
+            remove_from_shopping_list(request.user.id, recipe_id)
+            change_counter(Recipe, recipe_id, 'in_carts_count', -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,31 @@
+"""
+Прогрев процесса перед приёмом запросов.
+
+Без него первый запрос к каждому новому воркеру платит за шрифт
+ReportLab, импорт view и сборку каталогов тегов и ингредиентов.
+"""
+import logging
+import time
+
+from django.db import connections
+from django.urls import get_resolver
+
+from api import ingredient_search
+from api.catalogs import tag_catalog
+from api.shopping_list import register_fonts
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    started = time.monotonic()
+    register_fonts()
+    # Импортирует модули view и строит таблицы reverse() заранее.
+    get_resolver()._populate()
+    tag_catalog.get()
+    ingredient_search.get_index()
+    # Запросы обслуживают другие потоки со своими соединениями: открытое
+    # здесь для каталогов соединение только висело бы без дела.
+    connections.close_all()
+    logger.info('Воркер прогрет за %.0f мс',
+                (time.monotonic() - started) * 1000)
@@ -0,0 +1,25 @@
+"""
+Денормализованные счётчики моделей.
+
+Счётчики меняются только UPDATE ... SET field = field + delta (см.
+recipes/services.py). Обычный save() загруженного объекта записал бы
+их старые значения из памяти поверх чужих изменений, поэтому при
+сохранении без update_fields они пропускаются.
+"""
+
+
+class CounterFieldsMixin:
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            skipped = self.get_deferred_fields() | set(self.counter_fields)
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in skipped
+                and field.name not in skipped
+            ]
+        return super().save(*args, **kwargs)
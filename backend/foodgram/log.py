@@ -0,0 +1,87 @@
+"""
+Логирование без блокировки запросов.
+
+BackgroundHandler только кладёт запись в очередь; в stderr её пишет
+отдельный поток QueueListener. Если очередь переполнена, запись
+отбрасывается, а не задерживает запрос. JsonFormatter выводит по
+объекту JSON на строку, SamplingFilter пропускает долю шумных записей.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Поля записей django.db.backends и django.request, которые стоит сохранить.
+EXTRA_FIELDS = ('duration', 'sql', 'status_code')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+        }
+        for field in EXTRA_FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """ Пропускает долю rate записей ниже WARNING; предупреждения - все. """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return (record.levelno >= logging.WARNING
+                or self.rate >= 1
+                or random.random() < self.rate)
+
+
+class BackgroundHandler(QueueHandler):
+    def __init__(self, stream=None, capacity=10000):
+        self.stream = stream or sys.stderr
+        self.capacity = capacity
+        self.dropped = 0
+        super().__init__(queue.Queue(capacity))
+        self.start()
+        atexit.register(self.stop)
+        # Поток не переживает fork, поэтому воркеры gunicorn после
+        # preload_app запускают свой.
+        os.register_at_fork(after_in_child=self.restart)
+
+    def start(self):
+        self.listener = QueueListener(self.queue,
+                                      logging.StreamHandler(self.stream))
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart(self):
+        self.queue = queue.Queue(self.capacity)
+        self.start()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
@@ -0,0 +1,31 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для админки: на PostgreSQL для большой таблицы без фильтров
+    берёт оценку числа строк из pg_class вместо COUNT(*).
+    """
+    estimate_threshold = 100_000
+
+    def estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < self.estimate_threshold:
+            return None
+        return int(row[0])
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        return super().count if estimate is None else estimate
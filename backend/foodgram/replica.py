@@ -0,0 +1,100 @@
+"""
+Чтение с реплики базы данных.
+
+Middleware разрешает реплику только для безопасных запросов к API.
+После записи клиент (по заголовку Authorization или сессии) на
+REPLICA_PIN_SECONDS закрепляется за основной базой, чтобы сразу видеть
+свои изменения, даже если реплика отстаёт.
+"""
+import hashlib
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+REPLICA = 'replica'
+PRIMARY = 'default'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_PREFIX = 'db_pin'
+# Только что выданный токен может ещё не дойти до реплики.
+PRIMARY_MODELS = {'authtoken.token'}
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_enabled():
+    return REPLICA in settings.DATABASES
+
+
+def client_key(request):
+    """ Ключ клиента для закрепления за основной базой. """
+    credentials = (request.META.get('HTTP_AUTHORIZATION')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credentials:
+        return None
+    digest = hashlib.sha256(credentials.encode()).hexdigest()
+    return f'{PIN_PREFIX}:{digest}'
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replica_enabled() or not request.path.startswith('/api/'):
+            return self.get_response(request)
+        key = client_key(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if key is not None:
+                cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+            return response
+        token = _use_replica.set(key is None or not cache.get(key))
+        try:
+            return self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+
+    async def __acall__(self, request):
+        if not replica_enabled() or not request.path.startswith('/api/'):
+            return await self.get_response(request)
+        key = client_key(request)
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            if key is not None:
+                await cache.aset(key, True, settings.REPLICA_PIN_SECONDS)
+            return response
+        token = _use_replica.set(key is None or not await cache.aget(key))
+        try:
+            return await self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    """ Чтение на реплику, если разрешено; запись и миграции на основную. """
+
+    def db_for_read(self, model, **hints):
+        if (_use_replica.get()
+                and model._meta.label_lower not in PRIMARY_MODELS
+                and not connections[PRIMARY].in_atomic_block):
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
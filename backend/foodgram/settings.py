@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from pathlib import Path
 
@@ -6,7 +7,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.environ.get('SECRET_KEY', default='django-insecure-1')
 
-DEBUG = True
+# DEBUG=0 is the production profile: no SQL capture, JSON logs at INFO.
+DEBUG = os.getenv('DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = [
     '*', #becasue we are running a public web server
@@ -42,10 +44,16 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'foodgram.replica.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Server-Timing header and Prometheus metrics at /metrics, see api/metrics.py.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+if METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'api.metrics.MetricsMiddleware')
+
 ROOT_URLCONF = 'foodgram.urls'
 
 TEMPLATES = [
@@ -65,6 +73,12 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
+
+# 'asgi' is set by foodgram/asgi.py. Under ASGI read views run in their
+# own thread pool instead of Django's single thread for sync views.
+SERVER_INTERFACE = os.getenv('SERVER_INTERFACE', 'wsgi')
+ASGI_READ_THREADS = int(os.getenv('ASGI_READ_THREADS', 8))
 
 # force Django not to check secure cookies because we are using http not httpS
 CSRF_COOKIE_SECURE = False
@@ -88,10 +102,57 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        # Persistent connections, checked before reuse in each request.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # pgbouncer in transaction mode cannot keep server-side cursors.
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_PGBOUNCER') == '1',
     }
 }
 
+# Optional read replica, see foodgram/replica.py.
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['foodgram.replica.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 10))
+
+# Shared between gunicorn workers: rendered files and replica pins live in
+# 'default', collection versions (api/versions.py) in 'versions', so that
+# culling a full file cache never drops a version and serves stale ETags.
+# Point CACHE_BACKEND/CACHE_LOCATION at Redis for several hosts.
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'
+)
+CACHE_LOCATION = os.getenv(
+    'CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'foodgram_cache')
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    'versions': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': (CACHE_LOCATION + '_versions'
+                     if CACHE_BACKEND.endswith('FileBasedCache')
+                     else CACHE_LOCATION),
+        'KEY_PREFIX': 'versions',
+        'TIMEOUT': None,
+        # One key per collection and per recipe author; the limit only
+        # has to stay out of reach.
+        'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -114,8 +175,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
@@ -125,6 +185,16 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6,
 }
 
+# Token -> user pairs are cached in each process, see api/authentication.py.
+AUTH_CACHE_SECONDS = int(os.getenv('AUTH_CACHE_SECONDS', 300))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 10000))
+# Basic auth hashes the password with PBKDF2, so it is off unless asked
+# for; clients exchange credentials once at /api/auth/token/login/.
+if os.getenv('API_BASIC_AUTH', '0') == '1':
+    REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'].append(
+        'api.authentication.CachedBasicAuthentication'
+    )
+
 LANGUAGE_CODE = 'ru-ru'
 
 TIME_ZONE = 'UTC'
@@ -148,27 +218,45 @@ DJOSER = {
     'LOGIN_FIELD': 'email',
 }
 
+# Text logs in development, JSON in production. Handlers write from a
+# background thread, see foodgram/log.py.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text' if DEBUG else 'json')
+LOG_SQL_SAMPLE_RATE = float(os.getenv('LOG_SQL_SAMPLE_RATE', 0.05))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'default': {
+        'text': {
             'format': '[DJANGO] %(levelname)s %(asctime)s %(module)s '
                       '%(name)s.%(funcName)s:%(lineno)s: %(message)s'
         },
+        'json': {
+            '()': 'foodgram.log.JsonFormatter',
+        },
+    },
+    'filters': {
+        'sample_sql': {
+            '()': 'foodgram.log.SamplingFilter',
+            'rate': LOG_SQL_SAMPLE_RATE,
+        },
     },
     'handlers': {
         'console': {
-            'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-            'formatter': 'default',
+            'level': LOG_LEVEL,
+            'class': 'foodgram.log.BackgroundHandler',
+            'formatter': LOG_FORMAT,
         }
     },
     'loggers': {
         '': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
-        }
+        },
+        'django.db.backends': {
+            'filters': ['sample_sql'],
+        },
     },
 }
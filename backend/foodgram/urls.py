@@ -9,6 +9,10 @@ urlpatterns = [
     path('api/', include('api.urls', namespace='api')),
 ]
 
+if settings.METRICS_ENABLED:
+    from api.metrics import metrics
+    urlpatterns.append(path('metrics', metrics, name='metrics'))
+
 if settings.DEBUG:
     urlpatterns += static(
         settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
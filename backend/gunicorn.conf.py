@@ -0,0 +1,63 @@
+"""
+Настройки gunicorn; переопределяются переменными окружения GUNICORN_*.
+
+Приложение загружается в мастере до fork, поэтому воркеры получают
+готовые импорты и стартуют быстро. Каждый воркер прогревается
+в post_worker_init до того, как начнёт принимать запросы, а
+max_requests с разбросом не даёт всем воркерам перезапуститься разом.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+# Воркер из пакета uvicorn-worker: uvicorn.workers устарел.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS',
+                         'uvicorn_worker.UvicornWorker')
+# Асинхронному воркеру хватает процесса на ядро, синхронным нужен запас
+# на ожидание базы.
+default_workers = (cpu_count if worker_class.startswith('uvicorn')
+                   else cpu_count * 2 + 1)
+workers = int(os.getenv('GUNICORN_WORKERS', default_workers))
+# Используется только воркерами gthread.
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER',
+                                    max_requests // 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Файлы метрик воркеров; задаётся до загрузки приложения.
+os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram_metrics')
+)
+
+
+def on_starting(server):
+    # Метрики прошлого запуска не должны попасть в новые.
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def pre_fork(server, worker):
+    # Соединения мастера не должны достаться воркерам после fork.
+    if server.cfg.preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def post_worker_init(worker):
+    from api.warmup import warm_up
+    warm_up()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
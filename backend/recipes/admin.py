@@ -1,45 +1,117 @@
+from collections import defaultdict
+
 from django.contrib import admin
 from django.db.models import Count
-from recipes.models import (Favorite, Ingredient, ListCart,
-                            Recipe, Tag)
+
+from foodgram.paginators import EstimatedCountPaginator
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
+                            ListCart, Recipe, Tag)
+from recipes.services import (change_counter, get_recipe_amounts,
+                              remove_recipes, update_shopping_lists)
+from users.models import User
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """ Базовый класс для больших таблиц: без COUNT(*) на каждый запрос. """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = '--empty--'
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(ScalableAdmin):
     list_display = ('id', 'name', 'measurement_unit')
-    search_fields = ('name',)
-    empty_value_display = '--empty--'
+    search_fields = ('^name',)
+
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'color', 'slug')
-    list_filter = ('name', 'slug')
+    list_display = ('id', 'name', 'color', 'slug', 'recipes_count')
     search_fields = ('name', 'slug')
     empty_value_display = '--empty--'
 
-@admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author', 'favorite_count')
-    search_fields = ('name',)
-    empty_value_display = '--empty--'
-
-    def favorite_count(self, obj):
-        return obj.favorites.count()
+    @admin.display(description='Рецептов', ordering='recipes_count')
+    def recipes_count(self, obj):
+        return obj.recipes_count
 
     def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.annotate(
-            obj_count=Count("favorites", distinct=True),
+        return super().get_queryset(request).annotate(
+            recipes_count=Count('recipes')
         )
 
-@admin.register(Favorite)
-class FavoritetAdmin(admin.ModelAdmin):
+
+class IngredientInRecipeInline(admin.TabularInline):
+    model = IngredientInRecipe
+    autocomplete_fields = ('ingredient',)
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
+
+@admin.register(Recipe)
+class RecipeAdmin(ScalableAdmin):
+    list_display = ('id', 'name', 'author', 'pub_date', 'favorites_count',
+                    'in_carts_count')
+    list_select_related = ('author',)
+    list_filter = ('tags',)
+    search_fields = ('^name', '=author__username')
+    autocomplete_fields = ('author',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
+    inlines = (IngredientInRecipeInline,)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            change_counter(User, obj.author_id, 'recipes_count', 1)
+        elif 'author' in form.changed_data:
+            change_counter(User, form.initial['author'], 'recipes_count', -1)
+            change_counter(User, obj.author_id, 'recipes_count', 1)
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not IngredientInRecipe:
+            return super().save_formset(request, form, formset, change)
+        # Списки покупок тех, у кого рецепт в корзине, меняются вместе
+        # с ингредиентами, как при правке через API.
+        recipe = form.instance
+        old_amounts = get_recipe_amounts(recipe)
+        super().save_formset(request, form, formset, change)
+        update_shopping_lists(recipe, old_amounts,
+                              get_recipe_amounts(recipe))
+
+
+class RecipeRelationAdmin(ScalableAdmin):
+    """
+    Избранное и корзины: только просмотр и удаление. Удаление идёт через
+    recipes.services, чтобы счётчики и списки покупок не расходились.
+    """
     list_display = ('id', 'user', 'recipe')
-    empty_value_display = '--empty--'
+    list_select_related = ('user', 'recipe')
+    search_fields = ('=user__username', '^recipe__name')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        remove_recipes(self.model, obj.user_id, [obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = defaultdict(list)
+        for user_id, recipe_id in queryset.values_list('user_id',
+                                                       'recipe_id'):
+            recipe_ids[user_id].append(recipe_id)
+        for user_id, ids in recipe_ids.items():
+            remove_recipes(self.model, user_id, ids)
+
+
+@admin.register(Favorite)
+class FavoritetAdmin(RecipeRelationAdmin):
+    pass
+
 
 @admin.register(ListCart)
-class ListCartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'recipe')
-    search_fields = ('user', 'recipe')
-    list_filter = ('user', 'recipe')
-    empty_value_display = '--empty--'
+class ListCartAdmin(RecipeRelationAdmin):
+    pass
@@ -0,0 +1,135 @@
+"""
+Уменьшенные копии изображений рецептов.
+
+Из загруженного файла строится фиксированный набор копий в WebP и JPEG
+без метаданных. Рендер идёт в пуле потоков после коммита транзакции,
+чтобы время ответа на POST /api/recipes/ не зависело от размера файла.
+"""
+import io
+import logging
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': 320,
+    'card': 640,
+    'full': 1600,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True,
+             'progressive': True},
+}
+MAX_PIXELS = 40_000_000
+RENDITIONS_DIR = 'recipes/renditions'
+WORKERS = 2
+
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS,
+                               thread_name_prefix='recipe-images')
+
+
+def check_dimensions(file):
+    """ Не даёт принять слишком большое по пикселям изображение. """
+    position = file.tell()
+    try:
+        # Pillow сам отвергает заголовки больше MAX_IMAGE_PIXELS: и
+        # предупреждение, и ошибку превращаем в ValueError, как и свою.
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(file) as image:
+                width, height = image.size
+    except (Image.DecompressionBombError,
+            Image.DecompressionBombWarning) as error:
+        raise ValueError(
+            f'Изображение больше {MAX_PIXELS} пикселей'
+        ) from error
+    finally:
+        file.seek(position)
+    if width * height > MAX_PIXELS:
+        raise ValueError(
+            f'Изображение больше {MAX_PIXELS} пикселей: {width}x{height}'
+        )
+
+
+def render(file):
+    """ Возвращает {(rendition, format): bytes} без EXIF и прочих данных. """
+    with Image.open(file) as source:
+        if source.width * source.height > MAX_PIXELS:
+            raise ValueError('Изображение слишком большое')
+        image = ImageOps.exif_transpose(source)
+        image = image.convert(
+            'RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB'
+        )
+    result = {}
+    for name, size in RENDITIONS.items():
+        copy = image.copy()
+        copy.thumbnail((size, size), Image.LANCZOS)
+        for extension, options in FORMATS.items():
+            output = copy
+            if options['format'] == 'JPEG' and copy.mode != 'RGB':
+                output = Image.new('RGB', copy.size, 'white')
+                output.paste(copy, mask=copy.getchannel('A'))
+            buffer = io.BytesIO()
+            output.save(buffer, **options)
+            result[name, extension] = buffer.getvalue()
+    return result
+
+
+def build_renditions(recipe_id):
+    """ Рендерит копии и сохраняет пути в Recipe.renditions. """
+    recipe = Recipe.objects.filter(id=recipe_id).only(
+        'id', 'image', 'renditions'
+    ).first()
+    if recipe is None or not recipe.image:
+        return
+    image_name = recipe.image.name
+    with recipe.image.open('rb') as file:
+        rendered = render(file)
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    renditions = {}
+    for (name, extension), content in rendered.items():
+        path = default_storage.save(
+            f'{RENDITIONS_DIR}/{stem}_{name}.{extension}',
+            ContentFile(content)
+        )
+        renditions.setdefault(name, {})[extension] = path
+    updated = Recipe.objects.filter(
+        id=recipe_id, image=image_name
+    ).update(renditions=renditions, updated_at=timezone.now())
+    stale = recipe.renditions if updated else renditions
+    delete_renditions(stale)
+
+
+def delete_renditions(renditions):
+    for paths in (renditions or {}).values():
+        for path in paths.values():
+            default_storage.delete(path)
+
+
+def _run(recipe_id):
+    close_old_connections()
+    try:
+        build_renditions(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s',
+                         recipe_id)
+    finally:
+        connection.close()
+
+
+def schedule_renditions(recipe_id):
+    """ Ставит рендер в пул потоков после коммита текущей транзакции. """
+    transaction.on_commit(lambda: _executor.submit(_run, recipe_id))
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep=Min('id'), total=Count('id')
+    ).order_by().filter(total__gt=1)
+    for duplicate in duplicates:
+        keep = duplicate['keep']
+        extra = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=keep)
+        for model, owner in ((IngredientInRecipe, 'recipe_id'),
+                             (ShoppingListItem, 'user_id')):
+            for row in model.objects.filter(ingredient__in=extra):
+                merged = model.objects.filter(
+                    ingredient_id=keep, **{owner: getattr(row, owner)}
+                ).update(amount=F('amount') + row.amount)
+                if merged:
+                    row.delete()
+                else:
+                    row.ingredient_id = keep
+                    row.save(update_fields=['ingredient'])
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
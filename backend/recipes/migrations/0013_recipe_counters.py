@@ -0,0 +1,44 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('recipes', 'Recipe', 'favorites_count', 'recipes', 'Favorite',
+     'recipe'),
+    ('recipes', 'Recipe', 'in_carts_count', 'recipes', 'ListCart',
+     'recipe'),
+    ('users', 'User', 'recipes_count', 'recipes', 'Recipe', 'author'),
+    ('users', 'User', 'followers_count', 'users', 'Subscription', 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for app, model, field, source_app, source, lookup in COUNTERS:
+        rows = apps.get_model(source_app, source).objects.filter(
+            **{lookup: OuterRef('pk')}
+        ).order_by().values(lookup).annotate(total=Count('pk'))
+        apps.get_model(app, model).objects.update(**{
+            field: Coalesce(Subquery(rows.values('total')), 0)
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_updated_at'),
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,135 @@
+"""
+Полнотекстовый поиск рецептов по названию и описанию.
+
+На PostgreSQL используется столбец search_vector (tsvector с русским
+стеммингом) под GIN-индексом, на SQLite — таблица FTS5. Оба индекса
+поддерживаются триггерами базы, поэтому не отстают при bulk-операциях
+и правках через админку.
+"""
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# Вес совпадения в названии относительно описания для bm25.
+FTS_WEIGHTS = (10.0, 1.0)
+
+# Таблицу FTS5 и триггеры создаёт миграция 0015_recipe_search. SQLite
+# удаляет триггеры, когда миграция пересоздаёт таблицу рецептов, поэтому
+# они восстанавливаются после migrate; текст совпадает с миграцией.
+SQLITE_TRIGGERS = {
+    'recipes_recipe_fts_insert': f"""
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+    AFTER INSERT ON recipes_recipe
+    BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    'recipes_recipe_fts_delete': f"""
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+    AFTER DELETE ON recipes_recipe
+    BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    'recipes_recipe_fts_update': f"""
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe
+    BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+}
+
+
+def sqlite_objects(cursor, kind):
+    cursor.execute('SELECT name FROM sqlite_master WHERE type = %s', [kind])
+    return {row[0] for row in cursor.fetchall()}
+
+
+def ensure_sqlite_index(connection):
+    """
+    Восстанавливает триггеры FTS5 и переиндексирует таблицу, если
+    их не хватало.
+    """
+    with connection.cursor() as cursor:
+        if FTS_TABLE not in sqlite_objects(cursor, 'table'):
+            return
+        missing = SQLITE_TRIGGERS.keys() - sqlite_objects(cursor, 'trigger')
+        if not missing:
+            return
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+        )
+
+
+def fts5_query(value):
+    """ Слова запроса как префиксы в синтаксисе FTS5: "слово"* ... """
+    return ' '.join(
+        '"{}"*'.format(word.replace('"', '""')) for word in value.split()
+    )
+
+
+def search_postgresql(queryset, value, connection):
+    query = SearchQuery(value, config=CONFIG, search_type='websearch')
+    column = '{}.search_vector'.format(
+        connection.ops.quote_name(queryset.model._meta.db_table)
+    )
+    return queryset.alias(
+        search_vector=RawSQL(column, [], output_field=SearchVectorField())
+    ).filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query)
+    )
+
+
+def search_sqlite(queryset, value, connection):
+    match = fts5_query(value)
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    return queryset.filter(id__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        [match]
+    )).annotate(rank=RawSQL(
+        f'(SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id)',
+        [match], output_field=FloatField()
+    ))
+
+
+def search_contains(queryset, value, connection):
+    """ Запасной вариант для остальных баз: без индекса и ранжирования. """
+    condition = Q()
+    for word in value.split():
+        condition &= Q(name__icontains=word) | Q(text__icontains=word)
+    return queryset.filter(condition).annotate(
+        rank=Value(0.0, output_field=FloatField())
+    )
+
+
+SEARCHES = {
+    'postgresql': search_postgresql,
+    'sqlite': search_sqlite,
+}
+
+
+def search_recipes(queryset, value):
+    """
+    Рецепты, подходящие под запрос, с релевантностью в rank;
+    сначала самые релевантные.
+    """
+    value = value.strip()
+    if not value:
+        return queryset
+    connection = connections[queryset.db]
+    search = SEARCHES.get(connection.vendor, search_contains)
+    return search(queryset, value, connection).order_by('-rank', '-id')
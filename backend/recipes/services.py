@@ -0,0 +1,275 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import (Case, Count, F, OuterRef, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce
+
+from recipes.models import (Favorite, IngredientInRecipe, ListCart, Recipe,
+                            ShoppingListItem)
+from users.models import Subscription, User
+
+BATCH_SIZE = 1000
+
+# Денормализованные счётчики: (модель, поле, источник, связь с моделью).
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ListCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+)
+
+
+def get_recipe_amounts(recipe):
+    """ Количество каждого ингредиента рецепта: {ingredient_id: amount}. """
+    return dict(
+        IngredientInRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient_id', 'amount')
+    )
+
+
+def get_recipes_amounts(recipe_ids):
+    """ Сумма ингредиентов нескольких рецептов: {ingredient_id: amount}. """
+    return dict(
+        IngredientInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('ingredient_id').annotate(
+            total=Sum('amount')
+        ).order_by().values_list('ingredient_id', 'total')
+    )
+
+
+def apply_shopping_list_deltas(user_ids, deltas):
+    """
+    Прибавляет deltas ({ingredient_id: amount}) к спискам покупок
+    пользователей одним UPDATE с CASE по одинаковым изменениям.
+    """
+    user_ids = list(user_ids)
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not user_ids or not deltas:
+        return
+    by_delta = defaultdict(list)
+    for ingredient_id, delta in deltas.items():
+        by_delta[delta].append(ingredient_id)
+    items = ShoppingListItem.objects.filter(user_id__in=user_ids)
+    with transaction.atomic():
+        ShoppingListItem.objects.bulk_create(
+            [
+                ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items()
+                if delta > 0
+            ],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        items.filter(ingredient_id__in=deltas).update(
+            amount=F('amount') + Case(
+                *(When(ingredient_id__in=ingredient_ids, then=Value(delta))
+                  for delta, ingredient_ids in by_delta.items()),
+                default=Value(0),
+            )
+        )
+        if any(delta < 0 for delta in deltas.values()):
+            items.filter(
+                ingredient_id__in=deltas, amount__lte=0
+            ).delete()
+
+
+def add_to_shopping_list(user_id, recipe):
+    apply_shopping_list_deltas([user_id], get_recipe_amounts(recipe))
+
+
+def remove_from_shopping_list(user_id, recipe):
+    apply_shopping_list_deltas(
+        [user_id],
+        {key: -value for key, value in get_recipe_amounts(recipe).items()}
+    )
+
+
+def remove_from_all_shopping_lists(recipe):
+    """ Вычитает рецепт из списков всех, у кого он в корзине. """
+    apply_shopping_list_deltas(
+        ListCart.objects.filter(recipe=recipe).values_list(
+            'user_id', flat=True
+        ),
+        {key: -value for key, value in get_recipe_amounts(recipe).items()}
+    )
+
+
+def update_shopping_lists(recipe, old_amounts, new_amounts):
+    """ Переносит изменение ингредиентов рецепта в списки покупок. """
+    deltas = {
+        ingredient_id: (new_amounts.get(ingredient_id, 0)
+                        - old_amounts.get(ingredient_id, 0))
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+    apply_shopping_list_deltas(
+        ListCart.objects.filter(recipe=recipe).values_list(
+            'user_id', flat=True
+        ),
+        deltas
+    )
+
+
+def compute_shopping_lists():
+    """ Списки покупок, посчитанные заново по корзинам. """
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in ListCart.objects.filter(
+            recipe__ingredientinrecipe__isnull=False
+        ).values(
+            'user_id', 'recipe__ingredientinrecipe__ingredient_id'
+        ).annotate(
+            total=Sum('recipe__ingredientinrecipe__amount')
+        ).order_by().values_list(
+            'user_id', 'recipe__ingredientinrecipe__ingredient_id', 'total'
+        ).iterator(chunk_size=BATCH_SIZE)
+    }
+
+
+def change_counter(model, pk, field, delta):
+    """ Меняет счётчик одним UPDATE ... SET field = field + delta. """
+    if delta:
+        model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def change_counters(model, pks, field, delta):
+    """ Меняет счётчик у нескольких записей одним UPDATE. """
+    if delta and pks:
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def count_subquery(source, lookup):
+    """ Количество строк source, ссылающихся на внешнюю запись. """
+    rows = source.objects.filter(
+        **{lookup: OuterRef('pk')}
+    ).order_by().values(lookup).annotate(total=Count('pk'))
+    return Coalesce(Subquery(rows.values('total')), 0)
+
+
+def reconcile_counters(batch_size=BATCH_SIZE):
+    """
+    Пересчитывает счётчики по исходным таблицам пачками по pk
+    и исправляет расхождения. Возвращает {(модель, поле): исправлено}.
+    """
+    fixed = {}
+    for model, field, source, lookup in COUNTERS:
+        key = (model._meta.label, field)
+        fixed[key] = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk').only(
+                    'pk', field
+                ).annotate(actual=count_subquery(source, lookup))[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            stale = [obj for obj in batch
+                     if getattr(obj, field) != obj.actual]
+            for obj in stale:
+                setattr(obj, field, obj.actual)
+            model.objects.bulk_update(stale, [field])
+            fixed[key] += len(stale)
+    return fixed
+
+
+# Связи пользователь-рецепт, которые меняются пачками, и их счётчики.
+RECIPE_RELATIONS = {
+    Favorite: 'favorites_count',
+    ListCart: 'in_carts_count',
+}
+
+
+def release_user_counters(user_id):
+    """
+    Уменьшает счётчики чужих рецептов и авторов перед удалением
+    пользователя: его избранное, корзины и подписки удалит каскад.
+    """
+    for model, field in RECIPE_RELATIONS.items():
+        Recipe.objects.filter(pk__in=model.objects.filter(
+            user_id=user_id
+        ).values('recipe_id')).update(**{field: F(field) - 1})
+    User.objects.filter(pk__in=Subscription.objects.filter(
+        user_id=user_id
+    ).values('author_id')).update(followers_count=F('followers_count') - 1)
+
+
+def lock_user(user_id):
+    """
+    Блокирует строку пользователя до конца транзакции, чтобы пачки
+    одного пользователя не пересекались и счётчики сходились.
+    """
+    list(User.objects.select_for_update().filter(
+        pk=user_id
+    ).values_list('pk', flat=True))
+
+
+def add_recipes(model, user_id, recipe_ids):
+    """
+    Добавляет рецепты в избранное или корзину пользователя.
+    Возвращает {recipe_id: 'added' | 'exists' | 'not_found'}.
+    """
+    with transaction.atomic():
+        lock_user(user_id)
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('pk', flat=True))
+        present = set(model.objects.filter(
+            user_id=user_id, recipe_id__in=found
+        ).values_list('recipe_id', flat=True))
+        added = found - present
+        model.objects.bulk_create(
+            [model(user_id=user_id, recipe_id=pk) for pk in added],
+            ignore_conflicts=True,
+        )
+        change_counters(Recipe, added, RECIPE_RELATIONS[model], 1)
+        if model is ListCart and added:
+            apply_shopping_list_deltas([user_id],
+                                       get_recipes_amounts(added))
+    return {
+        pk: ('added' if pk in added
+             else 'exists' if pk in present else 'not_found')
+        for pk in recipe_ids
+    }
+
+
+def remove_recipes(model, user_id, recipe_ids):
+    """
+    Убирает рецепты из избранного или корзины пользователя.
+    Возвращает {recipe_id: 'removed' | 'absent'}.
+    """
+    with transaction.atomic():
+        lock_user(user_id)
+        rows = model.objects.filter(user_id=user_id,
+                                    recipe_id__in=recipe_ids)
+        removed = set(rows.values_list('recipe_id', flat=True))
+        if removed:
+            rows.delete()
+            change_counters(Recipe, removed, RECIPE_RELATIONS[model], -1)
+        if model is ListCart and removed:
+            apply_shopping_list_deltas(
+                [user_id],
+                {key: -value
+                 for key, value in get_recipes_amounts(removed).items()}
+            )
+    return {pk: 'removed' if pk in removed else 'absent'
+            for pk in recipe_ids}
+
+
+def check_recipes(model, user_id, recipe_ids):
+    """ {recipe_id: 'present' | 'absent' | 'not_found'}. """
+    present = set(model.objects.filter(
+        user_id=user_id, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    found = present | set(Recipe.objects.filter(
+        pk__in=set(recipe_ids) - present
+    ).values_list('pk', flat=True))
+    return {
+        pk: ('present' if pk in present
+             else 'absent' if pk in found else 'not_found')
+        for pk in recipe_ids
+    }
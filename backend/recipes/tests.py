@@ -0,0 +1,145 @@
+import io
+import struct
+import zlib
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from recipes.images import check_dimensions
+from recipes.models import (Ingredient, IngredientInRecipe, ListCart, Recipe,
+                            ShoppingListItem, Tag)
+from recipes.services import (add_recipes, compute_shopping_lists,
+                              reconcile_counters)
+from users.models import User
+
+LOCMEM = 'django.core.cache.backends.locmem.LocMemCache'
+# Кэши тестов в памяти: файловый кэш общий с локально запущенным
+# сервером, и тесты сбрасывали бы его PDF, закрепления и версии.
+locmem_caches = override_settings(CACHES={
+    'default': {'BACKEND': LOCMEM, 'LOCATION': 'tests'},
+    'versions': {'BACKEND': LOCMEM, 'LOCATION': 'tests-versions',
+                 'TIMEOUT': None},
+})
+
+
+def setUpModule():
+    locmem_caches.enable()
+
+
+def tearDownModule():
+    locmem_caches.disable()
+
+
+def png_header(width, height):
+    """ PNG из одного заголовка: размер есть, пикселей нет. """
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                         8, 2, 0, 0, 0))
+            + chunk(b'IEND', b''))
+
+
+class CheckDimensionsTests(SimpleTestCase):
+    def test_decompression_bomb_is_value_error(self):
+        with self.assertRaises(ValueError):
+            check_dimensions(io.BytesIO(png_header(10000, 9000)))
+
+    def test_between_limit_and_bomb_is_value_error(self):
+        with self.assertRaises(ValueError):
+            check_dimensions(io.BytesIO(png_header(8000, 6000)))
+
+    def test_position_is_restored(self):
+        file = io.BytesIO(png_header(100, 100))
+        check_dimensions(file)
+        self.assertEqual(file.tell(), 0)
+
+
+class AdminWritesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='secret'
+        )
+        cls.buyer = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='secret'
+        )
+        cls.tag = Tag.objects.create(name='Обед', color='#49B64E',
+                                     slug='lunch')
+        cls.flour, cls.sugar = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар')
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_recipe(self):
+        response = self.client.post('/admin/recipes/recipe/add/', {
+            'author': self.admin.pk, 'name': 'Пирог', 'text': 'Испечь',
+            'cooking_time': 10, 'tags': [self.tag.pk],
+            'ingredientinrecipe_set-TOTAL_FORMS': 1,
+            'ingredientinrecipe_set-INITIAL_FORMS': 0,
+            'ingredientinrecipe_set-0-ingredient': self.flour.pk,
+            'ingredientinrecipe_set-0-amount': 100,
+        })
+        self.assertEqual(response.status_code, 302)
+        recipe = Recipe.objects.get()
+        add_recipes(ListCart, self.buyer.pk, [recipe.pk])
+        return recipe
+
+    def assertConsistent(self):
+        self.assertEqual(
+            dict(((user_id, ingredient_id), amount)
+                 for user_id, ingredient_id, amount in
+                 ShoppingListItem.objects.values_list(
+                     'user_id', 'ingredient_id', 'amount'
+                 )),
+            compute_shopping_lists()
+        )
+        self.assertFalse(any(reconcile_counters().values()))
+
+    def test_ingredient_inline_updates_shopping_lists(self):
+        recipe = self.create_recipe()
+        row = IngredientInRecipe.objects.get(recipe=recipe)
+        response = self.client.post(
+            f'/admin/recipes/recipe/{recipe.pk}/change/', {
+                'author': self.admin.pk, 'name': 'Пирог', 'text': 'Испечь',
+                'cooking_time': 10, 'tags': [self.tag.pk],
+                'ingredientinrecipe_set-TOTAL_FORMS': 2,
+                'ingredientinrecipe_set-INITIAL_FORMS': 1,
+                'ingredientinrecipe_set-0-id': row.pk,
+                'ingredientinrecipe_set-0-recipe': recipe.pk,
+                'ingredientinrecipe_set-0-ingredient': self.flour.pk,
+                'ingredientinrecipe_set-0-amount': 250,
+                'ingredientinrecipe_set-1-recipe': recipe.pk,
+                'ingredientinrecipe_set-1-ingredient': self.sugar.pk,
+                'ingredientinrecipe_set-1-amount': 40,
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ShoppingListItem.objects.count(), 2)
+        self.assertConsistent()
+
+    def test_cart_delete_action(self):
+        recipe = self.create_recipe()
+        response = self.client.post('/admin/recipes/listcart/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': ListCart.objects.values_list('pk',
+                                                             flat=True),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ShoppingListItem.objects.exists())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.in_carts_count, 0)
+        self.assertConsistent()
+
+    def test_recipe_delete(self):
+        recipe = self.create_recipe()
+        response = self.client.post(
+            f'/admin/recipes/recipe/{recipe.pk}/delete/', {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertConsistent()
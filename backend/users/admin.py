@@ -1,7 +1,13 @@
+from collections import Counter
+
 from django.contrib import admin
+from django.db import transaction
 
+from foodgram.paginators import EstimatedCountPaginator
+from recipes.services import change_counter
 from users.models import Subscription, User
 
+
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = (
@@ -9,10 +15,15 @@ class UserAdmin(admin.ModelAdmin):
         'username',
         'email',
         'first_name',
-        'last_name'
+        'last_name',
+        'recipes_count',
+        'followers_count',
     )
-    search_fields = ('username', 'email')
-    list_filter = ('username', 'email')
+    search_fields = ('^username', '^email')
+    list_filter = ('is_staff', 'is_active')
+    readonly_fields = ('recipes_count', 'followers_count')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-empty-'
 
 
@@ -21,6 +32,28 @@ class SubscriptionAdmin(admin.ModelAdmin):
     list_display = (
         'id', 'author', 'user',
     )
-    search_fields = ('author',)
-    list_filter = ('author', 'user',)
+    list_select_related = ('author', 'user')
+    search_fields = ('=author__username', '=user__username')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-empty-'
+
+    # Подписки только просматриваются и удаляются: счётчик подписчиков
+    # меняется вместе с ними.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        obj.delete()
+        change_counter(User, obj.author_id, 'followers_count', -1)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        authors = Counter(queryset.values_list('author_id', flat=True))
+        queryset.delete()
+        for author_id, deleted in authors.items():
+            change_counter(User, author_id, 'followers_count', -deleted)
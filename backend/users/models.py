@@ -1,9 +1,13 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from foodgram.counters import CounterFieldsMixin
 
-class User(AbstractUser):
+
+class User(CounterFieldsMixin, AbstractUser):
     """ Модель пользователя. """
+    counter_fields = ('recipes_count', 'followers_count')
+
     username = models.CharField(
         db_index=True,
         max_length=150,
@@ -33,6 +37,16 @@ class User(AbstractUser):
         verbose_name='Подписка на данного пользователя',
         help_text='Отметьте для подписки на данного пользователя'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков'
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = (
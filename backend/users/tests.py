@@ -0,0 +1,26 @@
+from django.test import TestCase
+
+from recipes.services import change_counter
+from recipes.tests import locmem_caches
+from users.models import User
+
+
+def setUpModule():
+    locmem_caches.enable()
+
+
+def tearDownModule():
+    locmem_caches.disable()
+
+
+class CounterFieldsTests(TestCase):
+    def test_save_keeps_concurrent_counter_change(self):
+        user = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        change_counter(User, user.pk, 'followers_count', 1)
+        user.set_password('changed')
+        user.save()
+        user.refresh_from_db()
+        self.assertEqual(user.followers_count, 1)
+        self.assertTrue(user.check_password('changed'))